@@ -2,6 +2,10 @@ import json
 import boto3
 import logging
 import re
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -10,13 +14,91 @@ logger.setLevel(logging.INFO)
 bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
 lambda_client = boto3.client('lambda')
 
-def extract_configuration(query):
-    """Extracts Server, CPU, RAM, Storage, and Database details using AWS Bedrock."""
-    try:
-        logger.info(f"Extracting config from: {query}")
+# "invoke" calls CostCalculationLambda remotely; "inprocess" imports it from the same deployment package
+COST_ENGINE_MODE = os.environ.get("COST_ENGINE_MODE", "invoke").lower()
+
+# Streaming mode: servers priced in parallel while the model is still generating
+STREAM_PRICING_CONCURRENCY = int(os.environ.get("STREAM_PRICING_CONCURRENCY", "4"))
+
+# Bedrock extraction results keyed by normalized query (LRU with TTL per warm container)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = int(os.environ.get("QUERY_CACHE_TTL", "86400"))
+# Optional JSON file backing the cache across containers (e.g. on an EFS mount)
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH", "")
+query_cache = OrderedDict()
+query_cache_stats = {"hits": 0, "persistent_hits": 0, "misses": 0}
+# Spellings folded together when normalizing queries
+QUERY_UNIT_SPELLINGS = [
+    (re.compile(r'\b(?:gigabytes?|gigs?|gib|gbs)\b'), "gb"),
+    (re.compile(r'\b(?:terabytes?|tib|tbs)\b'), "tb"),
+    (re.compile(r'\b(?:v?cpus?|v?cores?)\b'), "cores"),
+    (re.compile(r'\b(?:memory|mem)\b'), "ram")
+]
+
+# Rule-based extraction tried before Bedrock; ambiguous queries still go to the model
+FAST_PATH_ENABLED = os.environ.get("FAST_PATH_ENABLED", "true").lower() == "true"
+CPU_PHRASE = re.compile(r'\b(\d+)\s*-?\s*(?:v?cpus?|v?cores?)\b|\b(?:v?cpus?|cores?)\s*(?:[:=]|of)\s*(\d+)\b', re.IGNORECASE)
+RAM_PHRASE = re.compile(
+    r'\b(\d+(?:\.\d+)?)\s*(GB|GiB|TB)\s*(?:of\s+)?(?:RAM|memory|mem)\b'
+    r'|\b(?:RAM|memory)\s*(?:[:=]|of)?\s*(\d+(?:\.\d+)?)\s*(GB|GiB|TB)\b',
+    re.IGNORECASE
+)
+STORAGE_PHRASE = re.compile(r'\b(\d+(?:\.\d+)?)\s*(PB|TB|GB|MB)\b(?:\s*(?:of\s+)?(SSD|HDD|NVMe)\b)?', re.IGNORECASE)
+# Words next to a size without a medium ("500 GB storage", "disk: 500 GB") that make it storage rather than, say, network bandwidth
+STORAGE_WORD_AFTER = re.compile(r'\s*(?:of\s+)?(?:storage|disks?|drives?|volumes?)\b', re.IGNORECASE)
+STORAGE_WORD_BEFORE = re.compile(r'\b(?:storage|disks?|drives?|volumes?)\s*(?:[:=]|of)?\s*$', re.IGNORECASE)
+# Ranges, alternatives and multipliers ("8-16 cores", "8 or 16 cores", "2x 1TB SSD") need the model to interpret
+AMBIGUOUS_PHRASE = re.compile(
+    r'\b\d+\s*(?:-|to|or)\s*\d+\b|\b\d+\s*[x\u00d7](?=\s|\d)|\b(?:around|approximately|about|roughly|at least|up to)\b',
+    re.IGNORECASE
+)
+# Database spellings mapped to the names CostCalculationLambda prices
+DATABASE_ALIASES = [
+    (re.compile(r'\b(?:microsoft\s+sql\s+server|ms\s*sql(?:\s+server)?|mssql|sql\s+server)\b', re.IGNORECASE), "Microsoft SQL Server"),
+    (re.compile(r'\b(?:postgresql|postgres)\b', re.IGNORECASE), "PostgreSQL"),
+    (re.compile(r'\bmysql\b', re.IGNORECASE), "MySQL"),
+    (re.compile(r'\boracle(?:\s+database|\s+db)?\b', re.IGNORECASE), "Oracle Database"),
+    (re.compile(r'\bredis\b', re.IGNORECASE), "Redis")
+]
+NO_DATABASE_PHRASE = re.compile(r'\b(?:no|without)\s+(?:an?\s+)?(?:database|db)\b', re.IGNORECASE)
+DATABASE_WORD = re.compile(r'\b(?:database|db)\b', re.IGNORECASE)
+# Engines CostCalculationLambda has no price for; naming one leaves the query to the model
+UNKNOWN_DATABASE_ENGINE = re.compile(
+    r'\b(?:\w+db|db2|mongo|cassandra|scylla|couchbase|elasticsearch|opensearch|sqlite|sybase|teradata|informix|'
+    r'(?:sap\s+)?hana|neo4j|memcached|valkey|aurora|snowflake|clickhouse|timescale|firebird|hbase|cosmos)\b',
+    re.IGNORECASE
+)
+SERVER_NAME_PHRASES = [
+    re.compile(r'\b(?:named|called)\s+["\']?([\w.-]+)', re.IGNORECASE),
+    re.compile(r'\b(?:for|as)\s+(?:an?\s+|the\s+|my\s+|our\s+)?([a-z][\w-]*(?:\s+[a-z][\w-]*)?)\s+server\b', re.IGNORECASE),
+    re.compile(r'\b([a-z][\w-]*)\s+server\b', re.IGNORECASE)
+]
+SERVER_NAME_STOPWORDS = {"a", "an", "the", "one", "another", "second", "third", "first", "each", "per", "my", "our", "new", "same", "this", "that"}
+SERVER_COUNT_PHRASE = re.compile(r'\b(\d+|two|three|four|five|six|seven|eight|nine|ten)\s+(?:identical\s+)?(?:servers|instances|vms|machines|nodes)\b', re.IGNORECASE)
+NUMBER_WORDS = {"two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+# Where one server's description ends and the next one's begins
+SEGMENT_BOUNDARY = re.compile(r'[;\n]|\.\s+|,\s*(?:and\s+)?|\s+(?:and|plus|also)\s+', re.IGNORECASE)
+
+def filter_requirement(req):
+    """Keeps a model-extracted server with usable CPU and RAM, normalized for the cost engine."""
+    if not isinstance(req, dict):
+        return None
+    cpu_match = re.search(r'(\d+)\s*[cC]ores', req.get('CPU', ''))
+    ram_match = re.search(r'(\d+)\s*[gG][bB]', req.get('RAM', ''))
+    if not (cpu_match and ram_match):
+        return None
+    return {
+        'Server Name': req.get('Server Name', 'Unknown'),
+        'CPU': int(cpu_match.group(1)),
+        'RAM': int(ram_match.group(1)),
+        'Storage': req.get('Storage', 'Unknown'),
+        'Database': req.get('Database', 'Unknown')
+    }
 
-        request_body = {
-            "inputText": f"""
+def build_extraction_request(query):
+    """Titan request body asking for the requirements of a query as JSON."""
+    return {
+        "inputText": f"""
             You are a strict JSON generator.
             Based on the user requirement below, extract only the server configuration in valid, structured JSON format. No extra text, no markdown, no explanation.
             Expected format:
@@ -33,12 +115,19 @@ def extract_configuration(query):
             }}
             User Input: "{query}"
             Respond ONLY with valid JSON wrapped in a dictionary with a key "requirements".""",
-            "textGenerationConfig": {
-                "maxTokenCount": 500,  # Increased to avoid truncation
-                "temperature": 0.2,  # Reduce randomness
-                "topP": 1
-            }
+        "textGenerationConfig": {
+            "maxTokenCount": 500,  # Increased to avoid truncation
+            "temperature": 0.2,  # Reduce randomness
+            "topP": 1
         }
+    }
+
+def extract_configuration(query):
+    """Extracts Server, CPU, RAM, Storage, and Database details using AWS Bedrock."""
+    try:
+        logger.info(f"Extracting config from: {query}")
+
+        request_body = build_extraction_request(query)
         logger.info(f"Request body: {request_body}")
 
         response = bedrock_runtime.invoke_model(
@@ -79,21 +168,7 @@ def extract_configuration(query):
                 logger.error(f"Unexpected format from Bedrock: {extracted_config}")
                 return {"error": "Invalid format in Bedrock response"}
 
-            filtered_requirements = []
-            for req in extracted_config["requirements"]:
-                if isinstance(req, dict):
-                    cpu_match = re.search(r'(\d+)\s*[cC]ores', req.get('CPU', ''))
-                    ram_match = re.search(r'(\d+)\s*[gG][bB]', req.get('RAM', ''))
-
-                    if cpu_match and ram_match:
-                        filtered_req = {
-                            'Server Name': req.get('Server Name', 'Unknown'),
-                            'CPU': int(cpu_match.group(1)),
-                            'RAM': int(ram_match.group(1)),
-                            'Storage': req.get('Storage', 'Unknown'),
-                            'Database': req.get('Database', 'Unknown')
-                        }
-                        filtered_requirements.append(filtered_req)
+            filtered_requirements = [filtered_req for filtered_req in map(filter_requirement, extracted_config["requirements"]) if filtered_req]
 
             logger.info(f"Filtered Requirements: {filtered_requirements}")
             return filtered_requirements
@@ -105,11 +180,226 @@ def extract_configuration(query):
         logger.error(f"Error extracting configuration: {str(e)}")
         raise
 
+def normalize_query(query):
+    """Case, whitespace, trailing punctuation and unit spellings are folded so
+    trivially reworded queries share a cache entry ("16 Gigabytes" == "16gb")."""
+    normalized = " ".join(query.lower().split()).rstrip(".!? ")
+    for pattern, replacement in QUERY_UNIT_SPELLINGS:
+        normalized = pattern.sub(replacement, normalized)
+    return re.sub(r'(\d)\s+(gb|tb|cores)\b', r'\1\2', normalized)
+
+class FileQueryCache:
+    """Persistent query cache in a local JSON file, loaded once per container.
+
+    Several containers may share the file (e.g. on EFS), so each write re-reads it
+    and merges, keeping the newer entry per query; a write racing another between
+    its read and rename can still drop that other write's entry, which only costs
+    a Bedrock call later.
+    """
+
+    def __init__(self, path, max_entries=QUERY_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = None
+
+    def read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self):
+        if self.entries is None:
+            self.entries = self.read()
+        return self.entries
+
+    def get(self, key):
+        entry = self.load().get(key)
+        return (entry["requirements"], entry["stored_at"]) if entry else None
+
+    def set(self, key, requirements, stored_at):
+        entries = self.read()
+        for name, entry in self.load().items():
+            if name not in entries or entries[name]["stored_at"] < entry["stored_at"]:
+                entries[name] = entry
+        entries[key] = {"requirements": requirements, "stored_at": stored_at}
+        for stale_key in sorted(entries, key=lambda name: entries[name]["stored_at"])[:max(0, len(entries) - self.max_entries)]:
+            del entries[stale_key]
+        self.entries = entries
+        temp_path = f"{self.path}.{os.getpid()}.{time.time_ns()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(temp_path, self.path)
+
+persistent_query_cache = FileQueryCache(QUERY_CACHE_PATH) if QUERY_CACHE_PATH else None
+
+def get_cached_configuration(query):
+    """Returns cached requirements for the query, or None; checks this container
+    first, then the persistent backend."""
+    key = normalize_query(query)
+    now = time.time()
+    cached = query_cache.get(key)
+    if cached is not None and now - cached[1] < QUERY_CACHE_TTL:
+        query_cache.move_to_end(key)
+        query_cache_stats["hits"] += 1
+        return [dict(req) for req in cached[0]]
+    if persistent_query_cache is not None:
+        try:
+            cached = persistent_query_cache.get(key)
+        except Exception as e:
+            logger.error(f"Error reading query cache: {str(e)}")
+            cached = None
+        if cached is not None and now - cached[1] < QUERY_CACHE_TTL:
+            remember_configuration(key, cached[0], cached[1], persist=False)
+            query_cache_stats["persistent_hits"] += 1
+            return [dict(req) for req in cached[0]]
+    query_cache_stats["misses"] += 1
+    return None
+
+def remember_configuration(key, requirements, stored_at=None, persist=True):
+    stored_at = stored_at or time.time()
+    query_cache[key] = ([dict(req) for req in requirements], stored_at)
+    query_cache.move_to_end(key)
+    while len(query_cache) > QUERY_CACHE_SIZE:
+        query_cache.popitem(last=False)
+    if persist and persistent_query_cache is not None:
+        try:
+            persistent_query_cache.set(key, requirements, stored_at)
+        except Exception as e:
+            logger.error(f"Error writing query cache: {str(e)}")
+
+def split_server_segments(query):
+    """Splits a query into one piece per CPU mention, cutting at the last boundary
+    between consecutive mentions so each server keeps the details that follow it."""
+    cpu_matches = list(CPU_PHRASE.finditer(query))
+    cuts = [0]
+    for previous, current in zip(cpu_matches, cpu_matches[1:]):
+        boundaries = [match.start() for match in SEGMENT_BOUNDARY.finditer(query, previous.end(), current.start())]
+        if not boundaries:
+            return None
+        cuts.append(boundaries[-1])
+    cuts.append(len(query))
+    return [query[start:end] for start, end in zip(cuts, cuts[1:])]
+
+def parse_server_segment(segment, position, total):
+    """Returns the requirement described by one segment, or None when it is ambiguous."""
+    cpu_matches = list(CPU_PHRASE.finditer(segment))
+    ram_matches = list(RAM_PHRASE.finditer(segment))
+    if len(cpu_matches) != 1 or len(ram_matches) != 1:
+        return None
+    cpu = int(cpu_matches[0].group(1) or cpu_matches[0].group(2))
+    ram_size, ram_unit = (ram_matches[0].group(1), ram_matches[0].group(2)) if ram_matches[0].group(1) else (ram_matches[0].group(3), ram_matches[0].group(4))
+    ram = float(ram_size) * (1024 if ram_unit.upper() == "TB" else 1)
+    if not ram.is_integer():
+        return None
+
+    ram_span = ram_matches[0].span()
+    storage_matches = [
+        match for match in STORAGE_PHRASE.finditer(segment)
+        if match.end() <= ram_span[0] or match.start() >= ram_span[1]
+    ]
+    # A bare size with nothing saying it is storage ("10 GB network") is left to the model
+    for match in storage_matches:
+        if not match.group(3) and not STORAGE_WORD_AFTER.match(segment, match.end()) and not STORAGE_WORD_BEFORE.search(segment, 0, match.start()):
+            return None
+    storage_items = [
+        f"{match.group(1)}{match.group(2).upper()}" + (f" {match.group(3).upper() if match.group(3).lower() != 'nvme' else 'NVMe'}" if match.group(3) else "")
+        for match in storage_matches
+    ]
+
+    databases = {name for pattern, name in DATABASE_ALIASES if pattern.search(segment)}
+    # Database names like "SQL Server" must not be read as server names
+    name_text = segment
+    for pattern, _ in DATABASE_ALIASES:
+        name_text = pattern.sub(" ", name_text)
+    if len(databases) > 1 or UNKNOWN_DATABASE_ENGINE.search(name_text):
+        return None
+    if databases:
+        database = databases.pop()
+    elif NO_DATABASE_PHRASE.search(segment):
+        database = "None"
+    elif DATABASE_WORD.search(segment):
+        return None
+    else:
+        database = "Unknown"
+
+    server_name = None
+    for pattern in SERVER_NAME_PHRASES:
+        for match in pattern.finditer(name_text):
+            words = [word for word in match.group(1).split() if word.lower() not in SERVER_NAME_STOPWORDS]
+            if words:
+                server_name = " ".join(words) if pattern is SERVER_NAME_PHRASES[0] else f"{' '.join(words).title()} Server"
+                break
+        if server_name:
+            break
+    return {
+        'Server Name': server_name or (f"Server {position}" if total > 1 else "Server"),
+        'CPU': cpu,
+        'RAM': int(ram),
+        'Storage': " + ".join(storage_items) or 'Unknown',
+        'Database': database
+    }
+
+def parse_configuration_rules(query):
+    """Extracts requirements from well-formed queries without calling Bedrock.
+
+    Returns requirements in the same shape as extract_configuration, or None when
+    the query is ambiguous (no CPU/RAM, ranges, unknown databases, ...) and the
+    model should read it instead.
+    """
+    if AMBIGUOUS_PHRASE.search(query):
+        return None
+    segments = split_server_segments(query)
+    if not segments:
+        return None
+    requirements = []
+    for position, segment in enumerate(segments, start=1):
+        requirement = parse_server_segment(segment, position, len(segments))
+        if requirement is None:
+            return None
+        requirements.append(requirement)
+
+    # "3 servers with ..." repeats a single description; with several descriptions the count must agree
+    count_match = SERVER_COUNT_PHRASE.search(query)
+    count = int(NUMBER_WORDS.get(count_match.group(1).lower(), count_match.group(1))) if count_match else 1
+    if len(requirements) > 1:
+        return requirements if count in (1, len(requirements)) else None
+    if count > 1:
+        return [{**requirements[0], 'Server Name': f"{requirements[0]['Server Name']} {number}"} for number in range(1, count + 1)]
+    return requirements
+
+def get_configuration(query):
+    """Returns (requirements or error, extraction path): the rule-based parser when it
+    understands the query, then the query cache, otherwise Bedrock."""
+    started = time.perf_counter()
+    if FAST_PATH_ENABLED:
+        requirements = parse_configuration_rules(query)
+        if requirements:
+            logger.info(f"Rule-based extraction took {(time.perf_counter() - started) * 1000:.1f} ms: {requirements}")
+            return requirements, "rules"
+    cached = get_cached_configuration(query)
+    if cached is not None:
+        logger.info(f"Query cache hit ({query_cache_stats}) in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return cached, "cache"
+    config_data = extract_configuration(query)
+    logger.info(f"Bedrock extraction took {(time.perf_counter() - started) * 1000:.1f} ms")
+    # Only usable answers are cached; errors are retried on the next request
+    if isinstance(config_data, list) and config_data:
+        remember_configuration(normalize_query(query), config_data)
+    return config_data, "bedrock"
+
 def invoke_cost_lambda(config_data):
     """Calls the existing Lambda function to estimate costs."""
     try:
         logger.info(f"Invoking cost Lambda with config: {config_data}")
-        
+        started = time.perf_counter()
+        if COST_ENGINE_MODE == "inprocess":
+            import CostCalculationLambda
+            processed_data = CostCalculationLambda.estimate_costs(config_data)
+            logger.info(f"Cost estimate (inprocess) took {(time.perf_counter() - started) * 1000:.1f} ms")
+            return processed_data
+
         # Wrap the list inside a dictionary with "requirements" key
         payload = {"requirements": config_data}
 
@@ -127,12 +417,156 @@ def invoke_cost_lambda(config_data):
             logger.error("Invalid response format from Cost Lambda")
             return {"error": "Invalid response from Cost Lambda"}
         logger.info(f"Processed Data: {processed_data}")
+        logger.info(f"Cost estimate (invoke) took {(time.perf_counter() - started) * 1000:.1f} ms")
         return processed_data
 
     except Exception as e:
         logger.error(f"Error invoking cost estimation Lambda: {str(e)}")
         return {"error": "Failed to invoke cost Lambda"}
 
+def bedrock_text_stream(query):
+    """Yields Titan's output text piece by piece through the Bedrock streaming API."""
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId='amazon.titan-text-express-v1',
+        contentType='application/json',
+        accept='application/json',
+        body=json.dumps(build_extraction_request(query))
+    )
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if chunk:
+            yield json.loads(chunk['bytes']).get('outputText', '')
+
+class RequirementStreamParser:
+    """Picks complete server objects out of the model's JSON as it streams in.
+
+    Objects are decoded from the first array in the output, so each server can be
+    priced before the rest of the completion has arrived. finish() falls back to
+    parsing the whole text when nothing could be read incrementally.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.position = None
+        self.closed = False
+        self.found = 0
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, piece):
+        self.text += piece
+        requirements = []
+        if self.position is None:
+            array_start = self.text.find("[")
+            if array_start < 0:
+                return requirements
+            self.position = array_start + 1
+        while not self.closed:
+            while self.position < len(self.text) and self.text[self.position] in " \t\r\n,":
+                self.position += 1
+            if self.position >= len(self.text):
+                break
+            if self.text[self.position] != "{":
+                self.closed = True
+                break
+            try:
+                req, end = self.decoder.raw_decode(self.text, self.position)
+            except json.JSONDecodeError:
+                break
+            self.position = end
+            self.found += 1
+            requirements.append(req)
+        return requirements
+
+    def finish(self):
+        if self.found:
+            return []
+        output_text = self.text.replace("```json", "").replace("```", "").strip()
+        try:
+            extracted_config = json.loads(output_text)
+        except json.JSONDecodeError:
+            logger.error(f"JSON Parsing Error in streamed response: {self.text}")
+            return []
+        if isinstance(extracted_config, dict):
+            extracted_config = extracted_config.get("requirements", [extracted_config])
+        return extracted_config if isinstance(extracted_config, list) else []
+
+def stream_requirements(query, model=None):
+    """Yields (requirement, extraction path) as each server is understood: all at once
+    from the rule-based parser or the query cache, one by one from the model."""
+    if FAST_PATH_ENABLED:
+        requirements = parse_configuration_rules(query)
+        if requirements:
+            for req in requirements:
+                yield req, "rules"
+            return
+    cached = get_cached_configuration(query)
+    if cached is not None:
+        for req in cached:
+            yield req, "cache"
+        return
+    parser = RequirementStreamParser()
+    extracted = []
+    for piece in (model or bedrock_text_stream)(query):
+        for req in map(filter_requirement, parser.feed(piece)):
+            if req:
+                extracted.append(req)
+                yield req, "bedrock"
+    for req in map(filter_requirement, parser.finish()):
+        if req:
+            extracted.append(req)
+            yield req, "bedrock"
+    if extracted:
+        remember_configuration(normalize_query(query), extracted)
+
+def ndjson_line(event):
+    return json.dumps(event, default=str) + "\n"
+
+def price_streamed_requirement(index, req, cost_engine):
+    rows = cost_engine([req])
+    if isinstance(rows, dict) and "error" in rows:
+        return {"event": "cost", "index": index, "error": rows["error"]}
+    if not rows:
+        return {"event": "cost", "index": index, "error": f"No instance found for {req['Server Name']}"}
+    return {"event": "cost", "index": index, "cost": rows[0]}
+
+def stream_estimate(query, model=None, cost_engine=None):
+    """Yields the estimate for a query as NDJSON lines.
+
+    A "requirement" line is sent for each server as soon as it is extracted and a
+    "cost" line as soon as that server is priced, followed by a closing "done" line
+    (or an "error" line). model is a callable returning the completion text in
+    pieces and cost_engine a callable pricing a list of requirements; both default
+    to Bedrock and the configured cost engine, and can be replaced with local fakes.
+    """
+    started = time.perf_counter()
+    cost_engine = cost_engine or invoke_cost_lambda
+    count = 0
+    extraction_path = None
+    pending = set()
+    try:
+        with ThreadPoolExecutor(max_workers=STREAM_PRICING_CONCURRENCY) as executor:
+            for req, extraction_path in stream_requirements(query, model):
+                yield ndjson_line({"event": "requirement", "index": count, "extraction_path": extraction_path, "requirement": req})
+                pending.add(executor.submit(price_streamed_requirement, count, req, cost_engine))
+                count += 1
+                done, pending = wait(pending, timeout=0)
+                for future in done:
+                    yield ndjson_line(future.result())
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield ndjson_line(future.result())
+    except Exception as e:
+        logger.error(f"Error streaming estimate: {str(e)}")
+        yield ndjson_line({"event": "error", "error": "Internal server error."})
+        return
+    if not count:
+        yield ndjson_line({"event": "error", "error": "No server configuration found in query."})
+        return
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"Streamed estimate for {count} servers ({extraction_path}) in {elapsed_ms} ms")
+    yield ndjson_line({"event": "done", "servers": count, "extraction_path": extraction_path, "elapsed_ms": elapsed_ms})
+
 def lambda_handler(event, context):
     logger.info(f"Received event: {event}")
     try:
@@ -147,22 +581,30 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "Missing 'query' parameter"})
             }
 
+        # NDJSON stream, buffered into one body where the runtime cannot stream responses
+        if body.get("stream"):
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/x-ndjson"},
+                "body": "".join(stream_estimate(query))
+            }
+
         # Extract parameters from user input
-        config_data = extract_configuration(query)
-        logger.info(f"Config Data: {config_data}")
+        config_data, extraction_path = get_configuration(query)
+        logger.info(f"Config Data ({extraction_path}): {config_data}")
 
         if "error" in config_data:
             return {
                 "statusCode": 400,
                 "headers": {"Content-Type": "application/json"},
-                "body": json.dumps(config_data)
+                "body": json.dumps({**config_data, "extraction_path": extraction_path})
             }
 
         # Get cost estimation
         cost_estimate = invoke_cost_lambda(config_data)
         logger.info(f"Cost Estimate: {cost_estimate}")
 
-        response_body = json.dumps({"cost_estimate": cost_estimate})
+        response_body = json.dumps({"cost_estimate": cost_estimate, "extraction_path": extraction_path})
         logger.info(f"Response Body: {response_body}")
 
         return {
@@ -1,7 +1,21 @@
 import json
+import io
+import csv
+import bisect
 import boto3
+from botocore.exceptions import ClientError
+import os
 import re
+import time
+import random
 import logging
+import threading
+import functools
+import heapq
+import itertools
+from collections import OrderedDict, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logger = logging.getLogger()
@@ -10,126 +24,615 @@ logger.setLevel(logging.INFO)
 # Create AWS Clients
 ec2_client = boto3.client('ec2')
 pricing_client = boto3.client("pricing", region_name="ap-south-1")
+s3_client = boto3.client("s3")
+
+# Offline price catalog (EC2 bulk offer file), from a local file or an S3 object
+PRICE_CATALOG_PATH = os.environ.get("PRICE_CATALOG_PATH", "")
+PRICE_CATALOG_BUCKET = os.environ.get("PRICE_CATALOG_BUCKET", "")
+PRICE_CATALOG_KEY = os.environ.get("PRICE_CATALOG_KEY", "")
+PRICE_CATALOG_TTL = int(os.environ.get("PRICE_CATALOG_TTL", "3600"))
+
+# Attribute values shared by the Pricing API filters and the catalog index
+PRICE_FILTER_DEFAULTS = {
+    "operatingSystem": "Linux",
+    "tenancy": "Shared",
+    "preInstalledSw": "NA",
+    "capacitystatus": "Used"
+}
+
+# Instance type catalogue cache (in memory per container, optionally persisted to a local file)
+INSTANCE_CATALOG_TTL = int(os.environ.get("INSTANCE_CATALOG_TTL", "86400"))
+INSTANCE_CATALOG_CACHE_PATH = os.environ.get("INSTANCE_CATALOG_CACHE_PATH", "/tmp/ec2_instance_types.json")
+instance_catalog = {"instances": {}, "shape_index": None, "loaded_at": 0.0}
+
+# Catalog state kept across warm invocations
+price_catalog = {"version": None, "source_version": None, "checked_at": 0.0, "prices": {}}
+
+# Container-scoped LRU of hourly prices keyed by (instance type, region)
+PRICE_CACHE_SIZE = int(os.environ.get("PRICE_CACHE_SIZE", "4096"))
+PRICE_CACHE_TTL = int(os.environ.get("PRICE_CACHE_TTL", "3600"))
+price_cache = OrderedDict()
+
+# Live Pricing API fetches: concurrency cap, token-bucket rate (requests/second) and throttling retries
+PRICING_MAX_WORKERS = int(os.environ.get("PRICING_MAX_WORKERS", "8"))
+PRICING_RATE_LIMIT = float(os.environ.get("PRICING_RATE_LIMIT", "10"))
+PRICING_MAX_RETRIES = int(os.environ.get("PRICING_MAX_RETRIES", "5"))
+PRICING_BACKOFF_BASE = float(os.environ.get("PRICING_BACKOFF_BASE", "0.2"))
+THROTTLING_ERROR_CODES = {"ThrottlingException", "Throttling", "TooManyRequestsException", "RequestLimitExceeded"}
+# Bucket capacity; at least one token so rates below 1 request/second can still be granted
+PRICING_BURST = max(1.0, PRICING_RATE_LIMIT)
+pricing_rate_limiter = {"tokens": PRICING_BURST, "updated_at": time.monotonic(), "lock": threading.Lock()}
+
+DEFAULT_REGION = "Asia Pacific (Mumbai)"
+
+# Consolidation packer: time budget in seconds and the largest instance it may propose
+CONSOLIDATION_TIME_BUDGET = float(os.environ.get("CONSOLIDATION_TIME_BUDGET", "5"))
+CONSOLIDATION_MAX_VCPUS = int(os.environ.get("CONSOLIDATION_MAX_VCPUS", "64"))
+
+# Streaming S3 output: multipart part size (S3 requires at least 5 MiB for all but the last part)
+MULTIPART_PART_SIZE = max(int(os.environ.get("MULTIPART_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+# Default headroom for alternative instances, as a fraction above the minimal shape's vCPUs and memory
+ALTERNATIVES_HEADROOM = float(os.environ.get("ALTERNATIVES_HEADROOM", "0.5"))
+
+HOURS_PER_MONTH = 24 * 30
+
+# Convert a dollar amount to integer cents, rounding half up
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+# Format integer cents as a dollar string
+def format_usd(cents):
+    sign = "-" if cents < 0 else ""
+    return f"{sign}${abs(cents) // 100}.{abs(cents) % 100:02d}"
+
+# Matched and costed requirement row with numeric fields
+class CostRecord:
+    """One requirement row carried through matching and costing.
+
+    Costs are integer cents; they are only formatted as dollar strings by to_dict.
+    """
+    __slots__ = (
+        "server_name", "cpu", "ram", "instance_type", "price_per_hour", "storage", "database",
+        "server_cents", "storage_cents", "database_cents", "alternatives"
+    )
+
+    def __init__(self, server_name, cpu, ram, instance_type, price_per_hour, storage, database):
+        self.server_name = server_name
+        self.cpu = cpu
+        self.ram = ram
+        self.instance_type = instance_type
+        self.price_per_hour = price_per_hour
+        self.storage = storage
+        self.database = database
+        self.server_cents = 0
+        self.storage_cents = 0
+        self.database_cents = 0
+        # (instance type, vCPUs, memory, hourly price) tuples, cheapest first
+        self.alternatives = None
+
+    @property
+    def total_cents(self):
+        return self.server_cents + self.storage_cents + self.database_cents
+
+    def to_match_dict(self):
+        """Row in the format returned by find_best_match."""
+        return {
+            "Server Name": self.server_name,
+            "CPU": self.cpu,
+            "RAM": self.ram,
+            "InstanceType": self.instance_type,
+            "PricePerHour": f"${self.price_per_hour}",
+            "Storage": self.storage,
+            "Database": self.database
+        }
+
+    def to_dict(self, raw=False):
+        """Costed row; dollar strings by default, plain numbers when raw is set."""
+        row = self.to_match_dict()
+        if raw:
+            row["PricePerHour"] = self.price_per_hour
+            row["Monthly Server Cost"] = self.server_cents / 100
+            row["Monthly Storage Cost"] = self.storage_cents / 100
+            row["Monthly Database Cost"] = self.database_cents / 100
+            row["Total Pricing"] = self.total_cents / 100
+        else:
+            row["Monthly Server Cost"] = format_usd(self.server_cents)
+            row["Monthly Storage Cost"] = format_usd(self.storage_cents)
+            row["Monthly Database Cost"] = format_usd(self.database_cents)
+            row["Total Pricing"] = format_usd(self.total_cents)
+        if self.alternatives is not None:
+            row["Alternatives"] = [
+                {
+                    "InstanceType": instance_type,
+                    "CPU": vcpus,
+                    "RAM": memory,
+                    "PricePerHour": price if raw else f"${price}",
+                    "Monthly Server Cost": (
+                        to_cents(Decimal(str(price)) * HOURS_PER_MONTH) / 100 if raw
+                        else format_usd(to_cents(Decimal(str(price)) * HOURS_PER_MONTH))
+                    )
+                }
+                for instance_type, vcpus, memory, price in self.alternatives
+            ]
+        return row
 
 # Fetch Available EC2 instance types
 def fetch_ec2_instance_types():
     try:
-        response = ec2_client.describe_instance_types()
-        instance_data = {
-            instance['InstanceType']: {
-                "vCPUs": instance['VCpuInfo']['DefaultVCpus'],
-                "MemoryMiB": instance['MemoryInfo']['SizeInMiB'] // 1024  # Convert MB to GB
-            }
-            for instance in response['InstanceTypes']
-        }      
+        instance_data = {}
+        paginator = ec2_client.get_paginator("describe_instance_types")
+        for page in paginator.paginate():
+            for instance in page['InstanceTypes']:
+                instance_data[instance['InstanceType']] = {
+                    "vCPUs": instance['VCpuInfo']['DefaultVCpus'],
+                    "MemoryMiB": instance['MemoryInfo']['SizeInMiB'] // 1024  # Convert MB to GB
+                }
         return instance_data
     except Exception as e:
         logger.error(f"Error fetching EC2 instance types: {e}")
         return {}
-      
+
+# Read the persisted instance catalogue if it is still fresh
+def read_instance_catalog_file():
+    if not INSTANCE_CATALOG_CACHE_PATH or not os.path.exists(INSTANCE_CATALOG_CACHE_PATH):
+        return None
+    try:
+        with open(INSTANCE_CATALOG_CACHE_PATH, "r", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+        if time.time() - cached["saved_at"] >= INSTANCE_CATALOG_TTL:
+            return None
+        return cached
+    except Exception as e:
+        logger.error(f"Error reading instance catalogue cache: {e}")
+        return None
+
+# Persist the instance catalogue so cold starts can skip the EC2 API
+def write_instance_catalog_file(instances, saved_at):
+    if not INSTANCE_CATALOG_CACHE_PATH:
+        return
+    try:
+        temp_path = f"{INSTANCE_CATALOG_CACHE_PATH}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"saved_at": saved_at, "instances": instances}, cache_file)
+        os.replace(temp_path, INSTANCE_CATALOG_CACHE_PATH)
+    except Exception as e:
+        logger.error(f"Error writing instance catalogue cache: {e}")
+
+# Get the EC2 instance catalogue, cached per container for INSTANCE_CATALOG_TTL seconds
+def get_ec2_instance_types(force=False):
+    """Returns (instances, shape_index). Warm invocations make no EC2 API calls."""
+    now = time.time()
+    if not force and instance_catalog["instances"] and now - instance_catalog["loaded_at"] < INSTANCE_CATALOG_TTL:
+        return instance_catalog["instances"], instance_catalog["shape_index"]
+    cached = None if force else read_instance_catalog_file()
+    if cached and cached.get("instances"):
+        instances, loaded_at = cached["instances"], cached["saved_at"]
+        logger.info(f"Loaded {len(instances)} instance types from {INSTANCE_CATALOG_CACHE_PATH}")
+    else:
+        instances, loaded_at = fetch_ec2_instance_types(), now
+        if not instances:
+            # Keep serving the previous catalogue rather than an empty one
+            return instance_catalog["instances"], instance_catalog["shape_index"]
+        write_instance_catalog_file(instances, loaded_at)
+        logger.info(f"Fetched {len(instances)} instance types from EC2")
+    instance_catalog["instances"] = instances
+    instance_catalog["shape_index"] = build_shape_index(instances)
+    instance_catalog["loaded_at"] = loaded_at
+    return instance_catalog["instances"], instance_catalog["shape_index"]
+
+# Index instance types by shape, sorted by (vCPUs, MemoryMiB)
+def build_shape_index(ec2_instances):
+    """Groups instance types by (vCPUs, MemoryMiB) and keeps each vCPU level's memory sizes sorted.
+
+    Instance types inside a group keep their catalogue order, so price ties
+    resolve the same way as a scan over ec2_instances.
+    """
+    groups = {}
+    for instance_name, instance in ec2_instances.items():
+        groups.setdefault((instance["vCPUs"], instance["MemoryMiB"]), []).append(instance_name)
+    level_memory = {}
+    for vcpus, memory in sorted(groups):
+        level_memory.setdefault(vcpus, []).append(memory)
+    return {"levels": sorted(level_memory), "level_memory": level_memory, "groups": groups}
+
+# Find the smallest (vCPUs, MemoryMiB) shape that satisfies a requirement
+def find_minimal_shape(req_cpu, req_ram, shape_index):
+    """Returns the lexicographically smallest feasible (vCPUs, MemoryMiB) shape, or None."""
+    levels = shape_index["levels"]
+    for vcpus in levels[bisect.bisect_left(levels, req_cpu):]:
+        memory_sizes = shape_index["level_memory"][vcpus]
+        position = bisect.bisect_left(memory_sizes, req_ram)
+        if position < len(memory_sizes):
+            return (vcpus, memory_sizes[position])
+    return None
+
+# Resolve the minimal shape of each distinct (CPU, RAM) requirement
+def resolve_requirement_shapes(requirements, shape_index):
+    """Returns ({(CPU, RAM): shape or None}, [distinct matched shapes in first-seen order])."""
+    shape_by_requirement = {}
+    for req in requirements:
+        req_shape = (int(req["CPU"]), int(req["RAM"]))
+        if req_shape not in shape_by_requirement:
+            shape_by_requirement[req_shape] = find_minimal_shape(req_shape[0], req_shape[1], shape_index)
+    matched_shapes = [shape for shape in dict.fromkeys(shape_by_requirement.values()) if shape]
+    return shape_by_requirement, matched_shapes
+
+# List the feasible shapes within a headroom of the minimal shape
+def find_candidate_shapes(req_cpu, req_ram, shape_index, headroom=None):
+    """Returns shapes with at least the required vCPUs and memory; with a headroom, shapes larger
+    than the minimal shape by more than that fraction in either dimension are left out."""
+    minimal_shape = find_minimal_shape(req_cpu, req_ram, shape_index)
+    if minimal_shape is None:
+        return []
+    levels = shape_index["levels"]
+    max_vcpus = minimal_shape[0] * (1 + headroom) if headroom is not None else float("inf")
+    max_memory = minimal_shape[1] * (1 + headroom) if headroom is not None else float("inf")
+    shapes = []
+    for vcpus in levels[bisect.bisect_left(levels, req_cpu):bisect.bisect_right(levels, max_vcpus)]:
+        memory_sizes = shape_index["level_memory"][vcpus]
+        for memory in memory_sizes[bisect.bisect_left(memory_sizes, req_ram):bisect.bisect_right(memory_sizes, max_memory)]:
+            shapes.append((vcpus, memory))
+    return shapes
+
+# Price-sorted members of a shape group, cached per region for the request
+def get_price_sorted_group(shape, shape_index, region, price_memo, sorted_groups):
+    if (shape, region) not in sorted_groups:
+        priced = []
+        for position, instance_name in enumerate(shape_index["groups"][shape]):
+            price = get_cached_price(instance_name, region, price_memo)
+            if price is not None:
+                priced.append((price, position, instance_name, shape[0], shape[1]))
+        priced.sort()
+        sorted_groups[(shape, region)] = priced
+    return sorted_groups[(shape, region)]
+
+# Select the k cheapest feasible instances for a requirement
+def find_alternatives(req_cpu, req_ram, k, shape_index, region, price_memo, sorted_groups, headroom=None):
+    """Merges the price-sorted candidate groups through a heap bounded by the number of groups
+    and stops after k instances, so no per-row sort of all candidates is needed."""
+    groups = [
+        get_price_sorted_group(shape, shape_index, region, price_memo, sorted_groups)
+        for shape in find_candidate_shapes(req_cpu, req_ram, shape_index, headroom)
+    ]
+    return [
+        (instance_name, vcpus, memory, price)
+        for price, _, instance_name, vcpus, memory in itertools.islice(heapq.merge(*groups), k)
+    ]
+
+# Price the instances of a shape group and select the cheapest
+def select_cheapest_instance(shape, shape_index, region, price_memo):
+    minimal_footprint = [
+        {"InstanceType": instance_name, "vCPUs": shape[0], "MemoryMiB": shape[1]}
+        for instance_name in shape_index["groups"][shape]
+    ]
+    logger.info(f"Minimal instances: {minimal_footprint}")
+
+    best_instance = None
+    lowest_price = float("inf")
+    for instance in minimal_footprint:
+        try:
+            price = get_cached_price(instance["InstanceType"], region, price_memo)
+            logger.info(f"Price for {instance['InstanceType']} in {region}: {price}")
+            if price is not None and price < lowest_price:
+                lowest_price = price
+                best_instance = instance
+                best_instance["PricePerHour"] = price
+                logger.info(f"New best instance: {best_instance} and price : {price}")
+        except ClientError as e:
+            logger.error(f"Error getting price for {instance['InstanceType']}: {e}")
+    return best_instance
+
 # Find best matching instances
-def find_best_match(requirements, ec2_instances, region="Asia Pacific (Mumbai)"):
+def find_best_match(requirements, ec2_instances, region=DEFAULT_REGION, shape_index=None, price_memo=None):
+    return [record.to_match_dict() for record in match_requirements(requirements, ec2_instances, region, shape_index, price_memo)]
+
+# Match requirements to CostRecords
+def match_requirements(requirements, ec2_instances, region=DEFAULT_REGION, shape_index=None, price_memo=None,
+                       alternatives=0, headroom=None):
+    """Matches each requirement to its cheapest minimal-footprint instance.
+
+    Requirements are grouped by their (CPU, RAM) shape; each distinct shape is
+    matched and priced once and the result is fanned back out in input order.
+    With alternatives set, each record also lists up to that many of the
+    cheapest feasible instances within the headroom of its minimal shape.
+    """
     if not requirements or not ec2_instances:
         logger.warning("Empty requirements or EC2 instances")
         return []
+    if shape_index is None:
+        shape_index = build_shape_index(ec2_instances)
+    if price_memo is None:
+        price_memo = new_price_memo()
+
+    # Steps 1-3: Resolve the minimal vCPU and RAM shape of each distinct requirement
+    shape_by_requirement, matched_shapes = resolve_requirement_shapes(requirements, shape_index)
+    prefetch_prices([name for shape in matched_shapes for name in shape_index["groups"][shape]], region, price_memo)
+
+    # Step 4: Get price for each instance of a shape and select the cheapest
+    best_by_shape = {shape: select_cheapest_instance(shape, shape_index, region, price_memo) for shape in matched_shapes}
+
+    alternatives_by_requirement = {}
+    if alternatives > 0:
+        candidate_shapes = {
+            req_shape: find_candidate_shapes(req_shape[0], req_shape[1], shape_index, headroom)
+            for req_shape in shape_by_requirement
+        }
+        prefetch_prices(
+            [name for shape in dict.fromkeys(itertools.chain(*candidate_shapes.values())) for name in shape_index["groups"][shape]],
+            region, price_memo
+        )
+        sorted_groups = {}
+        for req_shape in shape_by_requirement:
+            alternatives_by_requirement[req_shape] = find_alternatives(
+                req_shape[0], req_shape[1], alternatives, shape_index, region, price_memo, sorted_groups, headroom
+            )
+
     matched_instances = []
     for req in requirements:
-        req_cpu = int(req["CPU"])
-        req_ram = int(req["RAM"])
-        # Step 1: Filter instances that meet the requirement
-        candidate_instances = [
-            {
-                "InstanceType": instance_name,
-                "vCPUs": instance["vCPUs"],
-                "MemoryMiB": instance["MemoryMiB"]
-            }
-            for instance_name, instance in ec2_instances.items()
-            if instance["vCPUs"] >= req_cpu and instance["MemoryMiB"] >= req_ram
-        ]
-        logger.info(f"Candidate instances: {candidate_instances}")
-
-        if not candidate_instances:
+        req_shape = (int(req["CPU"]), int(req["RAM"]))
+        best_instance = best_by_shape.get(shape_by_requirement[req_shape])
+        if not best_instance:
             logger.warning(f"No instance found for: {req['Server Name']}")
             continue
 
-        # Step 2: Find minimum vCPU and RAM among candidates
-        min_vcpu = min(i["vCPUs"] for i in candidate_instances)
-        min_ram = min(i["MemoryMiB"] for i in candidate_instances if i["vCPUs"] == min_vcpu)
+        record = CostRecord(
+            req.get("Server Name", "Unknown"),
+            best_instance["vCPUs"],
+            best_instance["MemoryMiB"],
+            best_instance["InstanceType"],
+            best_instance["PricePerHour"],
+            req.get("Storage", ""),
+            req.get("Database", "")
+        )
+        if alternatives > 0:
+            record.alternatives = alternatives_by_requirement[req_shape]
+        matched_instances.append(record)
+    logger.info(f"Matched {len(matched_instances)} of {len(requirements)} requirements")
+    return matched_instances
 
-        # Step 3: Get all instances with minimal vCPU and RAM
-        minimal_footprint = [
-            i for i in candidate_instances if i["vCPUs"] == min_vcpu and i["MemoryMiB"] == min_ram
-        ]
-        logger.info(f"Minimal instances: {minimal_footprint}")
+# Build the catalog key for an instance type and location
+def price_catalog_key(instance_type, region):
+    return (
+        instance_type,
+        region,
+        PRICE_FILTER_DEFAULTS["operatingSystem"],
+        PRICE_FILTER_DEFAULTS["tenancy"],
+        PRICE_FILTER_DEFAULTS["preInstalledSw"],
+        PRICE_FILTER_DEFAULTS["capacitystatus"]
+    )
 
-        # Step 4: Get price for each and select the cheapest
-        best_instance = None
-        lowest_price = float("inf")
-        for instance in minimal_footprint:
-            try:
-                price = get_instance_price(instance["InstanceType"], region)
-                logger.info(f"Price for {instance['InstanceType']} in {region}: {price}")
-                if price is not None and price < lowest_price:
-                    lowest_price = price
-                    best_instance = instance
-                    best_instance["PricePerHour"] = price
-                    logger.info(f"New best instance: {best_instance} and price : {price}")
-            except ClientError as e:
-                logger.error(f"Error getting price for {instance['InstanceType']}: {e}")
-        
-        if best_instance:
-            matched_instances.append({
-                "Server Name": req.get("Server Name", "Unknown"),
-                "CPU": best_instance["vCPUs"],
-                "RAM": best_instance["MemoryMiB"],
-                "InstanceType": best_instance["InstanceType"],
-                "PricePerHour": f"${best_instance['PricePerHour']}",
-                "Storage": req.get("Storage", ""),
-                "Database": req.get("Database", "")
-            })
-    logger.info(f"Matched instances: {matched_instances}")
-    return matched_instances
+# Build a compact price index from an EC2 bulk offer file
+def build_price_index(offer):
+    """Maps (instanceType, location, operatingSystem, tenancy, preInstalledSw, capacitystatus) to the OnDemand hourly USD price."""
+    on_demand_terms = offer.get("terms", {}).get("OnDemand", {})
+    prices = {}
+    for sku, product in offer.get("products", {}).items():
+        attributes = product.get("attributes", {})
+        if "instanceType" not in attributes or sku not in on_demand_terms:
+            continue
+        price_per_hour = None
+        for term in on_demand_terms[sku].values():
+            for dimension in term.get("priceDimensions", {}).values():
+                if dimension.get("unit") == "Hrs" and "USD" in dimension.get("pricePerUnit", {}):
+                    price_per_hour = float(dimension["pricePerUnit"]["USD"])
+                    break
+            if price_per_hour is not None:
+                break
+        if price_per_hour is None:
+            continue
+        key = (
+            attributes["instanceType"],
+            attributes.get("location"),
+            attributes.get("operatingSystem"),
+            attributes.get("tenancy"),
+            attributes.get("preInstalledSw"),
+            attributes.get("capacitystatus")
+        )
+        prices[key] = price_per_hour
+    return prices
 
-# Get instance pricing
-def get_instance_price(instance_type, region="Asia Pacific (Mumbai)"):
+# Version marker of the configured offer file (mtime for local files, ETag for S3 objects)
+def get_price_catalog_source_version():
+    if PRICE_CATALOG_PATH:
+        return str(os.path.getmtime(PRICE_CATALOG_PATH))
+    response = s3_client.head_object(Bucket=PRICE_CATALOG_BUCKET, Key=PRICE_CATALOG_KEY)
+    return response["ETag"]
+
+# Read the configured offer file
+def read_price_catalog_source():
+    if PRICE_CATALOG_PATH:
+        with open(PRICE_CATALOG_PATH, "r", encoding="utf-8") as catalog_file:
+            return json.load(catalog_file)
+    s3_object = s3_client.get_object(Bucket=PRICE_CATALOG_BUCKET, Key=PRICE_CATALOG_KEY)
+    return json.loads(s3_object["Body"].read())
+
+# Load the price catalog once per container and reload it when the source changes
+def load_price_catalog(force=False):
+    """Returns the catalog index, or None when no catalog is configured or it cannot be read.
+
+    A warm container re-checks the source version at most once every PRICE_CATALOG_TTL
+    seconds and only re-reads the offer file when that version has changed. Failed or
+    empty loads are throttled the same way, so a bad offer file is not re-read per price.
+    """
+    if not PRICE_CATALOG_PATH and not (PRICE_CATALOG_BUCKET and PRICE_CATALOG_KEY):
+        return None
+    now = time.time()
+    if not force and price_catalog["checked_at"] and now - price_catalog["checked_at"] < PRICE_CATALOG_TTL:
+        return price_catalog["prices"] or None
+    price_catalog["checked_at"] = now
+    source_version = None
     try:
-        response = pricing_client.get_products(
-            ServiceCode="AmazonEC2",
-            Filters=[
-                {"Type": "TERM_MATCH", "Field": "instanceType", "Value": instance_type},
-                {"Type": "TERM_MATCH", "Field": "location", "Value": region},
-                {"Type": "TERM_MATCH", "Field": "operatingSystem", "Value": "Linux"},
-                {"Type": "TERM_MATCH", "Field": "tenancy", "Value": "Shared"},
-                {"Type": "TERM_MATCH", "Field": "preInstalledSw", "Value": "NA"},
-                {"Type": "TERM_MATCH", "Field": "capacitystatus", "Value": "Used"}
-            ]
-        )
-        price_data = response["PriceList"]
-        if not price_data:
-            return None
-        price_json = json.loads(price_data[0])
-        price_per_hour = float(price_json['terms']['OnDemand'].values().__iter__().__next__()['priceDimensions'].values().__iter__().__next__()['pricePerUnit']['USD'])
-        return price_per_hour
+        source_version = get_price_catalog_source_version()
+        if force or source_version != price_catalog["source_version"]:
+            offer = read_price_catalog_source()
+            prices = build_price_index(offer)
+            # Unusable content is not re-read until the source changes
+            price_catalog["source_version"] = source_version
+            if not prices:
+                logger.error(f"Price catalog {source_version} contains no prices")
+                return price_catalog["prices"] or None
+            price_catalog["prices"] = prices
+            price_cache.clear()
+            price_catalog["version"] = offer.get("version") or offer.get("publicationDate") or source_version
+            logger.info(f"Loaded price catalog version {price_catalog['version']} with {len(price_catalog['prices'])} prices")
+    except ValueError as e:
+        logger.error(f"Error parsing price catalog {source_version}: {e}")
+        # A corrupt offer file is not re-read until the source changes
+        if source_version is not None:
+            price_catalog["source_version"] = source_version
     except Exception as e:
-        logger.error(f"Error fetching price for {instance_type}: {e}")
+        # Keep serving the last good catalog, if any; retried after PRICE_CATALOG_TTL
+        logger.error(f"Error loading price catalog: {e}")
+    return price_catalog["prices"] or None
+
+# Wait for a Pricing API token from the shared token bucket
+def acquire_pricing_token():
+    if PRICING_RATE_LIMIT <= 0:
+        return
+    while True:
+        with pricing_rate_limiter["lock"]:
+            now = time.monotonic()
+            elapsed = now - pricing_rate_limiter["updated_at"]
+            pricing_rate_limiter["tokens"] = min(PRICING_BURST, pricing_rate_limiter["tokens"] + elapsed * PRICING_RATE_LIMIT)
+            pricing_rate_limiter["updated_at"] = now
+            if pricing_rate_limiter["tokens"] >= 1:
+                pricing_rate_limiter["tokens"] -= 1
+                return
+            wait_seconds = (1 - pricing_rate_limiter["tokens"]) / PRICING_RATE_LIMIT
+        time.sleep(wait_seconds)
+
+# Query the Pricing API for one instance type; errors are raised to the caller
+def query_instance_price(instance_type, region):
+    response = pricing_client.get_products(
+        ServiceCode="AmazonEC2",
+        Filters=[
+            {"Type": "TERM_MATCH", "Field": "instanceType", "Value": instance_type},
+            {"Type": "TERM_MATCH", "Field": "location", "Value": region}
+        ] + [
+            {"Type": "TERM_MATCH", "Field": field, "Value": value}
+            for field, value in PRICE_FILTER_DEFAULTS.items()
+        ]
+    )
+    price_data = response["PriceList"]
+    if not price_data:
         return None
+    price_json = json.loads(price_data[0])
+    price_per_hour = float(price_json['terms']['OnDemand'].values().__iter__().__next__()['priceDimensions'].values().__iter__().__next__()['pricePerUnit']['USD'])
+    return price_per_hour
+
+# Get instance pricing
+def get_instance_price(instance_type, region=DEFAULT_REGION):
+    prices = load_price_catalog()
+    if prices is not None:
+        return prices.get(price_catalog_key(instance_type, region))
+    for attempt in range(PRICING_MAX_RETRIES + 1):
+        acquire_pricing_token()
+        try:
+            return query_instance_price(instance_type, region)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in THROTTLING_ERROR_CODES or attempt == PRICING_MAX_RETRIES:
+                logger.error(f"Error fetching price for {instance_type}: {e}")
+                return None
+            # Exponential backoff with jitter before retrying a throttled call
+            delay = PRICING_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+            logger.warning(f"Throttled fetching price for {instance_type}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+        except Exception as e:
+            logger.error(f"Error fetching price for {instance_type}: {e}")
+            return None
+
+# Price many instance types concurrently and record them in the memo
+def prefetch_prices(instance_types, region, price_memo):
+    """Fetches prices missing from the memo and container cache through a bounded thread pool.
+
+    With a price catalog loaded every lookup is a dictionary hit, so nothing is prefetched.
+    """
+    if load_price_catalog() is not None:
+        return
+    now = time.time()
+    missing = [
+        instance_type for instance_type in dict.fromkeys(instance_types)
+        if (instance_type, region) not in price_memo["prices"]
+        and not ((instance_type, region) in price_cache and now - price_cache[(instance_type, region)][1] < PRICE_CACHE_TTL)
+    ]
+    if len(missing) < 2 or PRICING_MAX_WORKERS <= 1:
+        return
+    logger.info(f"Prefetching {len(missing)} prices in {region} with {PRICING_MAX_WORKERS} workers")
+    with ThreadPoolExecutor(max_workers=PRICING_MAX_WORKERS) as executor:
+        prices = list(executor.map(lambda instance_type: get_instance_price(instance_type, region), missing))
+    for instance_type, price in zip(missing, prices):
+        price_memo["misses"] += 1
+        store_price((instance_type, region), price, price_memo)
+
+# Create a request-scoped price memo
+def new_price_memo():
+    return {"prices": {}, "hits": 0, "container_hits": 0, "misses": 0}
+
+# Get instance pricing once per (instance type, region) per request
+def get_cached_price(instance_type, region, price_memo):
+    """Looks the price up in the request memo, then the container LRU, then the catalog or Pricing API."""
+    key = (instance_type, region)
+    if key in price_memo["prices"]:
+        price_memo["hits"] += 1
+        return price_memo["prices"][key]
+    cached = price_cache.get(key)
+    if cached is not None and time.time() - cached[1] < PRICE_CACHE_TTL:
+        price_cache.move_to_end(key)
+        price_memo["container_hits"] += 1
+        price = cached[0]
+    else:
+        price_memo["misses"] += 1
+        price = get_instance_price(instance_type, region)
+    store_price(key, price, price_memo)
+    return price
+
+# Record a price in the request memo and the container LRU
+def store_price(key, price, price_memo):
+    price_memo["prices"][key] = price
+    # Failed lookups are only memoized for this request so they are retried later
+    if price is not None:
+        price_cache[key] = (price, time.time())
+        price_cache.move_to_end(key)
+        while len(price_cache) > PRICE_CACHE_SIZE:
+            price_cache.popitem(last=False)
+
+# Summarize price lookups for the response metadata
+def get_price_metadata(price_memo):
+    return {
+        "price_cache": {
+            "hits": price_memo["hits"],
+            "container_hits": price_memo["container_hits"],
+            "misses": price_memo["misses"]
+        },
+        "price_catalog_version": price_catalog["version"]
+    }
+
+# Storage spec parsing shared by storage and database costing
+STORAGE_SIZE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(PB|TB|GB|MB)', re.IGNORECASE)
+STORAGE_MEDIUM_PATTERN = re.compile(r'(SSD|HDD|NVMe)', re.IGNORECASE)
+STORAGE_UNIT_TO_GB = {"MB": 1 / 1024, "GB": 1, "TB": 1024, "PB": 1024 * 1024}
+StorageSpec = namedtuple("StorageSpec", ["items", "total_gb"])
+
+# Parse a storage string such as "1TB SSD + 2TB HDD" into (size in GB, medium) items
+@functools.lru_cache(maxsize=4096)
+def parse_storage_spec(storage_str):
+    """Returns a StorageSpec; items without a recognised medium carry None as their medium."""
+    items = []
+    for storage in str(storage_str or "").split("+"):
+        size_match = STORAGE_SIZE_PATTERN.search(storage)
+        if not size_match:
+            continue
+        medium_match = STORAGE_MEDIUM_PATTERN.search(storage)
+        size_gb = float(size_match.group(1)) * STORAGE_UNIT_TO_GB[size_match.group(2).upper()]
+        items.append((size_gb, medium_match.group(1).upper() if medium_match else None))
+    return StorageSpec(tuple(items), sum(size_gb for size_gb, _ in items))
 
 # Calculate storage cost
 def calculate_storage_cost(storage_str):
     storage_cost_per_gb = {"SSD": 0.08, "HDD": 0.045, "NVME": 0.10}
     total_cost = 0
-    storage_items = storage_str.split("+")
-    for storage in storage_items:
-        storage = storage.strip()
-        size_match = re.search(r'(\d+)(TB|GB)', storage, re.IGNORECASE)
-        type_match = re.search(r'(SSD|HDD|NVMe)', storage, re.IGNORECASE)
-        if not size_match or not type_match:
-            continue
-        size_value = int(size_match.group(1))
-        storage_type = type_match.group(1).strip().upper()  # Convert to uppercase
-        # Convert TB to GB
-        size_gb = size_value * 1024 if size_match.group(2).upper() == "TB" else size_value
-        storage_type = type_match.group(1).upper()
+    for size_gb, storage_type in parse_storage_spec(storage_str).items:
         if storage_type in storage_cost_per_gb:
             total_cost += size_gb * storage_cost_per_gb[storage_type]
     return round(total_cost, 2)
@@ -139,33 +642,351 @@ def calculate_database_cost(database, storage_str):
     database_cost_per_gb = {"MySQL": 0.10, "PostgreSQL": 0.10, "Microsoft SQL Server": 0.20, "Oracle Database": 0.30, "Redis": 0.15}
     if database == "None" or database not in database_cost_per_gb:
         return 0.0
-    size_match = re.search(r'(\d+)(TB|GB)', storage_str, re.IGNORECASE)
-    if not size_match:
-        return 0.0
-    size_value = int(size_match.group(1))
-    size_gb = size_value * 1024 if size_match.group(2).upper() == "TB" else size_value
+    size_gb = parse_storage_spec(storage_str).total_gb
     return round(size_gb * database_cost_per_gb[database], 2)
 
+# Calculate monthly costs once per distinct (instance type, storage, database) shape
+def calculate_costs(records):
+    costs_by_shape = {}
+    for record in records:
+        storage = str(record.storage or "").strip()
+        database = str(record.database or "").strip()
+        shape = (record.price_per_hour, storage, database)
+        if shape not in costs_by_shape:
+            costs_by_shape[shape] = (
+                to_cents(Decimal(str(record.price_per_hour)) * HOURS_PER_MONTH),
+                to_cents(calculate_storage_cost(storage)),
+                to_cents(calculate_database_cost(database, storage))
+            )
+        record.server_cents, record.storage_cents, record.database_cents = costs_by_shape[shape]
+    return records
+
+# Sum the monthly costs of a batch
+def summarize_costs(records, raw=False):
+    totals = {
+        "Monthly Server Cost": sum(record.server_cents for record in records),
+        "Monthly Storage Cost": sum(record.storage_cents for record in records),
+        "Monthly Database Cost": sum(record.database_cents for record in records)
+    }
+    totals["Total Pricing"] = sum(totals.values())
+    return {name: cents / 100 if raw else format_usd(cents) for name, cents in totals.items()}
+
+# Pack small servers onto fewer, larger instances
+def consolidate_requirements(requirements, ec2_instances, region=DEFAULT_REGION, shape_index=None, price_memo=None,
+                             time_budget=CONSOLIDATION_TIME_BUDGET):
+    """Proposes a cheaper set of instances for the (CPU, RAM) requirements with first-fit-decreasing.
+
+    Bin types are the cheapest instance of each shape up to CONSOLIDATION_MAX_VCPUS,
+    tried in price-per-resource order. The time budget covers packing only, not
+    pricing; once it is spent, remaining servers keep their one-to-one baseline
+    instance, as do servers too large for any bin type, so Savings only reflect
+    packing. Every packed bin is finally right-sized to the cheapest shape that
+    holds its contents.
+    """
+    started = time.perf_counter()
+    if shape_index is None:
+        shape_index = build_shape_index(ec2_instances)
+    if price_memo is None:
+        price_memo = new_price_memo()
+
+    # One-to-one baseline, per distinct requirement shape
+    shape_by_requirement, matched_shapes = resolve_requirement_shapes(requirements, shape_index)
+    # Sub-GiB types (t3.nano and the like) are catalogued with 0 GB and cannot hold a server
+    bin_shapes = [shape for shape in shape_index["groups"] if 0 < shape[0] <= CONSOLIDATION_MAX_VCPUS and shape[1] > 0]
+    prefetch_prices(
+        [name for shape in dict.fromkeys(matched_shapes + bin_shapes) for name in shape_index["groups"][shape]],
+        region, price_memo
+    )
+    cheapest_by_shape = {}
+    for shape in dict.fromkeys(matched_shapes + bin_shapes):
+        best_instance = select_cheapest_instance(shape, shape_index, region, price_memo)
+        if best_instance:
+            cheapest_by_shape[shape] = best_instance
+
+    items = []
+    for req in requirements:
+        req_shape = (int(req["CPU"]), int(req["RAM"]))
+        if shape_by_requirement[req_shape] in cheapest_by_shape:
+            items.append((req_shape[0], req_shape[1], req.get("Server Name", "Unknown")))
+    if not items:
+        return None
+    baseline_cents = sum(
+        to_cents(Decimal(str(cheapest_by_shape[shape_by_requirement[(cpu, ram)]]["PricePerHour"])) * HOURS_PER_MONTH)
+        for cpu, ram, _ in items
+    )
+
+    # Weigh vCPUs and memory by their share of the inventory
+    cpu_weight = 1 / max(sum(cpu for cpu, _, _ in items), 1)
+    ram_weight = 1 / max(sum(ram for _, ram, _ in items), 1)
+    # Rank types by price per average server they can hold (their scarcer resource),
+    # so lopsided shapes such as 1 vCPU / 256 GB are not mistaken for cheap capacity;
+    # equally efficient types are tried largest first so bins have room to fill
+    bin_types = sorted(
+        (shape for shape in bin_shapes if shape in cheapest_by_shape),
+        key=lambda shape: (
+            round(cheapest_by_shape[shape]["PricePerHour"] / min(shape[0] * cpu_weight, shape[1] * ram_weight), 9),
+            -shape[0], -shape[1]
+        )
+    )
+    items.sort(key=lambda item: item[0] * cpu_weight + item[1] * ram_weight, reverse=True)
+
+    # First-fit-decreasing; a bin is [free vCPUs, free memory, used vCPUs, used memory, server names]
+    open_bins = []
+    closed_bins = []
+    unpacked = []
+    complete = True
+    packing_started = time.perf_counter()
+    for position, (cpu, ram, server_name) in enumerate(items):
+        if position % 256 == 0 and time.perf_counter() - packing_started > time_budget:
+            complete = False
+            unpacked.extend(items[position:])
+            break
+        target = next((current for current in open_bins if current[0] >= cpu and current[1] >= ram), None)
+        if target is None:
+            bin_shape = next((shape for shape in bin_types if shape[0] >= cpu and shape[1] >= ram), None)
+            if bin_shape is None:
+                unpacked.append((cpu, ram, server_name))
+                continue
+            target = [bin_shape[0], bin_shape[1], 0, 0, []]
+            open_bins.append(target)
+        target[0] -= cpu
+        target[1] -= ram
+        target[2] += cpu
+        target[3] += ram
+        target[4].append(server_name)
+        if target[0] == 0 or target[1] == 0:
+            open_bins.remove(target)
+            closed_bins.append(target)
+    closed_bins.extend(open_bins)
+
+    # Right-size each packed bin to the cheapest shape that holds its contents
+    right_sized = {}
+    placements = []
+    for _, _, used_cpu, used_ram, server_names in closed_bins:
+        if (used_cpu, used_ram) not in right_sized:
+            candidates = [
+                cheapest_by_shape[shape] for shape in find_candidate_shapes(used_cpu, used_ram, shape_index)
+                if shape in cheapest_by_shape
+            ]
+            right_sized[(used_cpu, used_ram)] = min(candidates, key=lambda instance: instance["PricePerHour"])
+        placements.append((right_sized[(used_cpu, used_ram)], server_names))
+    # Unpacked servers stay on their baseline instance
+    placements.extend((cheapest_by_shape[shape_by_requirement[(cpu, ram)]], [name]) for cpu, ram, name in unpacked)
+
+    instances = []
+    consolidated_cents = 0
+    for best_instance, server_names in placements:
+        monthly_cents = to_cents(Decimal(str(best_instance["PricePerHour"])) * HOURS_PER_MONTH)
+        consolidated_cents += monthly_cents
+        instances.append({
+            "InstanceType": best_instance["InstanceType"],
+            "CPU": best_instance["vCPUs"],
+            "RAM": best_instance["MemoryMiB"],
+            "Servers": server_names,
+            "PricePerHour": f"${best_instance['PricePerHour']}",
+            "Monthly Server Cost": format_usd(monthly_cents)
+        })
+
+    runtime = time.perf_counter() - started
+    logger.info(f"Consolidated {len(items)} servers onto {len(instances)} instances in {runtime:.3f}s")
+    return {
+        "Instances": instances,
+        "Monthly Server Cost": format_usd(consolidated_cents),
+        "Baseline Monthly Server Cost": format_usd(baseline_cents),
+        "Savings": format_usd(baseline_cents - consolidated_cents),
+        "Runtime Seconds": round(runtime, 3),
+        "Complete": complete
+    }
+
+# Compare the best instance and monthly cost of each server across several regions
+def compare_regions(requirements, ec2_instances, regions, shape_index=None, price_memo=None, raw=False):
+    """Matches each requirement's shape once and varies only the price lookup per region.
+
+    Pricing work grows with the number of distinct instance types per region,
+    not with regions x rows.
+    """
+    if not requirements or not ec2_instances or not regions:
+        logger.warning("Empty requirements, EC2 instances or regions")
+        return []
+    if shape_index is None:
+        shape_index = build_shape_index(ec2_instances)
+    if price_memo is None:
+        price_memo = new_price_memo()
+
+    shape_by_requirement, matched_shapes = resolve_requirement_shapes(requirements, shape_index)
+    instance_names = [name for shape in matched_shapes for name in shape_index["groups"][shape]]
+
+    best_by_region = {}
+    for region in regions:
+        prefetch_prices(instance_names, region, price_memo)
+        best_by_region[region] = {
+            shape: select_cheapest_instance(shape, shape_index, region, price_memo) for shape in matched_shapes
+        }
+
+    other_costs_by_spec = {}
+    comparisons = []
+    for req in requirements:
+        shape = shape_by_requirement[(int(req["CPU"]), int(req["RAM"]))]
+        storage = str(req.get("Storage") or "").strip()
+        database = str(req.get("Database") or "").strip()
+        if (storage, database) not in other_costs_by_spec:
+            other_costs_by_spec[(storage, database)] = to_cents(calculate_storage_cost(storage)) + to_cents(calculate_database_cost(database, storage))
+        other_cents = other_costs_by_spec[(storage, database)]
+
+        region_costs = {}
+        for region in regions:
+            best_instance = best_by_region[region].get(shape)
+            if not best_instance:
+                continue
+            server_cents = to_cents(Decimal(str(best_instance["PricePerHour"])) * HOURS_PER_MONTH)
+            region_costs[region] = (best_instance, server_cents, server_cents + other_cents)
+        if not region_costs:
+            logger.warning(f"No instance found in any region for: {req.get('Server Name', 'Unknown')}")
+            continue
+        cheapest_region = min(region_costs, key=lambda region: region_costs[region][2])
+        comparisons.append({
+            "Server Name": req.get("Server Name", "Unknown"),
+            "Storage": req.get("Storage", ""),
+            "Database": req.get("Database", ""),
+            "Regions": {
+                region: {
+                    "InstanceType": best_instance["InstanceType"],
+                    "CPU": best_instance["vCPUs"],
+                    "RAM": best_instance["MemoryMiB"],
+                    "PricePerHour": best_instance["PricePerHour"] if raw else f"${best_instance['PricePerHour']}",
+                    "Monthly Server Cost": server_cents / 100 if raw else format_usd(server_cents),
+                    "Total Pricing": total_cents / 100 if raw else format_usd(total_cents)
+                }
+                for region, (best_instance, server_cents, total_cents) in region_costs.items()
+            },
+            "Cheapest Region": cheapest_region,
+            "Cheapest Total Pricing": region_costs[cheapest_region][2] / 100 if raw else format_usd(region_costs[cheapest_region][2])
+        })
+    return comparisons
+
+# Yield serialized result rows one at a time
+def iter_cost_rows(records, raw=False):
+    for record in records:
+        row = record.to_dict(raw)
+        if "Alternatives" in row:
+            row["Alternatives"] = json.dumps(row["Alternatives"])
+        yield row
+
+# Write result rows to S3 as CSV incrementally with a multipart upload
+def stream_rows_to_s3(rows, bucket, key):
+    """Returns the number of rows written. Small outputs fall back to a single put_object."""
+    buffer = io.StringIO()
+    writer = None
+    upload_id = None
+    parts = []
+    row_count = 0
+    try:
+        for row in rows:
+            if writer is None:
+                writer = csv.DictWriter(buffer, fieldnames=list(row), extrasaction="ignore", lineterminator="\n")
+                writer.writeheader()
+            writer.writerow(row)
+            row_count += 1
+            if buffer.tell() >= MULTIPART_PART_SIZE:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType="text/csv")["UploadId"]
+                part = s3_client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1,
+                    Body=buffer.getvalue().encode("utf-8")
+                )
+                parts.append({"PartNumber": len(parts) + 1, "ETag": part["ETag"]})
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=writer.fieldnames, extrasaction="ignore", lineterminator="\n")
+
+        if upload_id is None:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue().encode("utf-8"), ContentType="text/csv")
+        else:
+            if buffer.tell():
+                part = s3_client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1,
+                    Body=buffer.getvalue().encode("utf-8")
+                )
+                parts.append({"PartNumber": len(parts) + 1, "ETag": part["ETag"]})
+            s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+        logger.info(f"Streamed {row_count} rows to s3://{bucket}/{key} in {max(len(parts), 1)} part(s)")
+        return row_count
+    except Exception:
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+# Match and cost requirements against the cached instance catalogue
+def estimate_cost_records(requirements, price_memo=None, alternatives=0, headroom=ALTERNATIVES_HEADROOM):
+    """Costed CostRecords for requirements; the matching path is picked the same way
+    for the Lambda handler and for in-process callers."""
+    if not requirements:
+        return []
+    ec2_instances, shape_index = get_ec2_instance_types()
+    if price_memo is None:
+        price_memo = new_price_memo()
+    if alternatives > 0:
+        records = match_requirements(
+            requirements, ec2_instances, shape_index=shape_index, price_memo=price_memo,
+            alternatives=alternatives, headroom=headroom
+        )
+    else:
+        records = match_requirements(requirements, ec2_instances, shape_index=shape_index, price_memo=price_memo)
+    calculate_costs(records)
+    return records
+
+# Library entry point: costed rows without a Lambda invoke or JSON round trip
+def estimate_costs(requirements, raw=False, alternatives=0, headroom=ALTERNATIVES_HEADROOM):
+    """Returns the same rows as the handler's JSON body, for callers that import this module."""
+    return [record.to_dict(raw) for record in estimate_cost_records(requirements, alternatives=alternatives, headroom=headroom)]
+
 # Lambda handler function
 def lambda_handler(event, context):
     logger.info("Received event: " + json.dumps(event))
-    ec2_instances = fetch_ec2_instance_types()
     try:
         requirements = event.get("requirements", [])
         logger.info("Extracted requirements: " + json.dumps(requirements))
+        if not requirements:
+            logger.warning("Empty requirements")
+            return {"statusCode": 200, "body": json.dumps([])}
+
+        ec2_instances, shape_index = get_ec2_instance_types()
+        price_memo = new_price_memo()
+        raw = bool(event.get("raw_numbers"))
+        regions = event.get("regions")
+        if regions:
+            comparisons = compare_regions(requirements, ec2_instances, regions, shape_index=shape_index, price_memo=price_memo, raw=raw)
+            return {"statusCode": 200, "body": json.dumps(comparisons), "metadata": get_price_metadata(price_memo)}
 
-        matched_instances = find_best_match(requirements, ec2_instances)
-        
-        # Calculate pricing
-        for instance in matched_instances:
-            hourly_price = get_instance_price(instance['InstanceType'])
-            instance["Monthly Server Cost"] = f"${round(hourly_price * 24 * 30, 2)}" if hourly_price else "Price Not Available"
-            instance["Monthly Storage Cost"] = f"${calculate_storage_cost(instance['Storage']):.2f}"
-            instance["Monthly Database Cost"] = f"${calculate_database_cost(instance['Database'], instance['Storage']):.2f}"
-            instance["Total Pricing"] = f"${round(float(instance['Monthly Server Cost'][1:]) + float(instance['Monthly Storage Cost'][1:]) + float(instance['Monthly Database Cost'][1:]), 2)}"
-        
-        logger.info(f"Final matched instances: {json.dumps(matched_instances)}")
-        return {"statusCode": 200, "body": json.dumps(matched_instances)}
+        headroom = event.get("headroom", ALTERNATIVES_HEADROOM)
+        records = estimate_cost_records(
+            requirements, price_memo=price_memo, alternatives=int(event.get("alternatives") or 0),
+            headroom=float(headroom) if headroom is not None else None
+        )
+
+        metadata = get_price_metadata(price_memo)
+        metadata["totals"] = summarize_costs(records, raw)
+        output = event.get("output")
+        if output:
+            # Stream rows straight to S3 and return only the location and totals
+            row_count = stream_rows_to_s3(iter_cost_rows(records, raw), output["bucket"], output["key"])
+            summary = {"bucket": output["bucket"], "key": output["key"], "rows": row_count, "totals": metadata["totals"]}
+            response = {"statusCode": 200, "body": json.dumps(summary), "metadata": metadata}
+        else:
+            # Format once, at the serialization edge
+            matched_instances = [record.to_dict(raw) for record in records]
+            logger.info(f"Final matched instances: {json.dumps(matched_instances)}")
+            response = {"statusCode": 200, "body": json.dumps(matched_instances), "metadata": metadata}
+        if event.get("consolidate"):
+            # A failed consolidation must not cost the caller the per-row results
+            try:
+                response["consolidation"] = consolidate_requirements(
+                    requirements, ec2_instances, shape_index=shape_index, price_memo=price_memo,
+                    time_budget=float(event.get("consolidation_time_budget", CONSOLIDATION_TIME_BUDGET))
+                )
+            except Exception as e:
+                logger.error(f"Error consolidating requirements: {e}")
+                response["consolidation"] = None
+        return response
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         return {"statusCode": 500, "body": json.dumps(f"Unexpected error: {e}")}
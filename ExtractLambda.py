@@ -4,10 +4,28 @@ import pandas as pd
 import io
 import os
 import re
+import csv
+import tempfile
+import time
+import shutil
+import hashlib
 import logging
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pytz
 
+try:
+    from openpyxl import load_workbook
+except ImportError:  # Workbooks fall back to pandas when openpyxl is not bundled
+    load_workbook = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet and Arrow output need pyarrow bundled; CSV does not
+    pa = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -23,28 +41,142 @@ current_time_ist = datetime.now(ist)
 # Format timestamp as "HH:MM:SS_DD-MM-YYYY"
 timestamp_str = current_time_ist.strftime("%H:%M:%S_%d-%m-%Y")
 
+# CPU/RAM patterns shared by the per-row and columnar extractors
+CPU_PATTERN = re.compile(r'(\d+)\s*(?:Cores|vCPU|CPU|cpu)', re.IGNORECASE)
+RAM_PATTERN = re.compile(r'(\d+)')
+# Rows per DataFrame chunk for columnar extraction
+EXTRACT_CHUNK_SIZE = int(os.environ.get("EXTRACT_CHUNK_SIZE", "50000"))
+
 # Environment variables
 BUCKET_NAME = os.environ.get("S3_BUCKET_NAME", "price-inventory")
 CALCULATE_LAMBDA_NAME = os.environ.get("CALCULATE_LAMBDA_NAME", "CostCalculationLambda")
+# Let CostCalculationLambda write the CSV to S3 itself and return only its location and totals
+STREAM_RESULTS = os.environ.get("STREAM_RESULTS", "false").lower() == "true"
+# Fan-out of large uploads: requirements per CostCalculationLambda invocation, parallel invocations and retries per shard
+COST_SHARD_SIZE = int(os.environ.get("COST_SHARD_SIZE", "2000"))
+COST_MAX_CONCURRENCY = int(os.environ.get("COST_MAX_CONCURRENCY", "4"))
+COST_SHARD_RETRIES = int(os.environ.get("COST_SHARD_RETRIES", "2"))
+# "invoke" calls CostCalculationLambda remotely; "inprocess" imports it from the same deployment package
+COST_ENGINE_MODE = os.environ.get("COST_ENGINE_MODE", "invoke").lower()
+# Inventory sheets of one workbook parsed and priced in parallel
+SHEET_MAX_CONCURRENCY = int(os.environ.get("SHEET_MAX_CONCURRENCY", "4"))
+COST_COLUMNS = ["Monthly Server Cost", "Monthly Storage Cost", "Monthly Database Cost", "Total Pricing"]
+# Format of the priced results: "csv", "parquet" or "arrow" (Arrow IPC file)
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "csv").lower()
+OUTPUT_CONTENT_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+# Rows encoded per chunk when writing results, and the S3 multipart part size for streamed CSV (S3 requires at least 5 MiB)
+OUTPUT_CHUNK_ROWS = int(os.environ.get("OUTPUT_CHUNK_ROWS", "10000"))
+MULTIPART_PART_SIZE = max(int(os.environ.get("MULTIPART_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+# Typed columns of Parquet/Arrow output; every other column is written as text
+RESULT_COLUMN_TYPES = {
+    "CPU": "int64", "RAM": "int64", "PricePerHour": "float64",
+    **{column: "float64" for column in COST_COLUMNS}
+}
+# Content-addressed result cache: a local directory or an S3 bucket (off when neither is set)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+RESULT_CACHE_BUCKET = os.environ.get("RESULT_CACHE_BUCKET", "")
+RESULT_CACHE_PREFIX = os.environ.get("RESULT_CACHE_PREFIX", "result-cache/")
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "200"))
+# Bump when the output format changes so older cached results are not served
+RESULT_CACHE_SCHEMA = "2"
+# Per-lineage snapshots for incremental re-pricing: a local directory or an S3 bucket (off when neither is set)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "")
+SNAPSHOT_BUCKET = os.environ.get("SNAPSHOT_BUCKET", "")
+SNAPSHOT_PREFIX = os.environ.get("SNAPSHOT_PREFIX", "snapshots/")
+# Copy markers stripped from file names so re-uploads share a lineage, e.g. "inventory (2)", "inventory_v3" or
+# "inventory - Copy"; version and copy markers need a separator so names like "inventory_nov2" stay intact
+LINEAGE_SUFFIX_PATTERN = re.compile(r'(?:\s*\(\d+\)|[\s_-]+v\d+|[\s-]+copy)+$', re.IGNORECASE)
+# Requirement fields that determine a row's cost
+COST_KEY_FIELDS = ("CPU", "RAM", "Storage", "Database")
+# Price catalog the cost engine reads, used to version cached results
+PRICE_CATALOG_BUCKET = os.environ.get("PRICE_CATALOG_BUCKET", "")
+PRICE_CATALOG_KEY = os.environ.get("PRICE_CATALOG_KEY", "")
+
+# Cell text that pandas reads as a missing value
+NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+}
+
+# Replace NaN and missing-value cells with None, like the pandas reader
+def clean_cell(value):
+    if isinstance(value, float) and pd.isna(value):
+        return None
+    if isinstance(value, str) and value in NA_STRINGS:
+        return None
+    return value
 
-# Fetch and read the Excel file from S3
-def fetch_requirements_from_s3(bucket, file_key):
-    logger.info(f"S3 Trigger Event Bucket: {bucket}, Key: {file_key}")
+# Name header cells the way pandas does
+def header_names(header_row):
+    return [str(name) if name is not None else f"Unnamed: {position}" for position, name in enumerate(header_row)]
+
+# Stream rows of one sheet (the first by default) of a local .xlsx file
+def iter_xlsx_rows(file_path, sheet_name=None):
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
     try:
-        s3_object = s3_client.get_object(Bucket=bucket, Key=file_key)
-        file_stream = io.BytesIO(s3_object["Body"].read())
-        df = pd.read_excel(file_stream)
-        df = df.where(pd.notna(df), None)    # Replace NaN values with None
-        requirements = df.to_dict(orient="records")
-        logger.info(f"Requirements fetched from S3: {requirements}")
-        return requirements
-    except Exception as e:
-        logger.error(f"Error fetching file from S3: {e}")
-        return []
+        worksheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = header_names(next(rows, ()))
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            yield {name: clean_cell(value) for name, value in zip(header, values)}
+    finally:
+        workbook.close()
+
+# Stream rows of a local CSV file
+def iter_csv_rows(file_path):
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        header = header_names(next(reader, []))
+        for values in reader:
+            if not any(values):
+                continue
+            yield {name: clean_cell(value) for name, value in zip(header, values)}
+
+# Download the uploaded file to /tmp once
+def download_upload(bucket, file_key):
+    local_file, local_path = tempfile.mkstemp(suffix=os.path.splitext(file_key)[1].lower())
+    os.close(local_file)
+    s3_client.download_file(bucket, file_key, local_path)
+    return local_path
+
+# Whether a local upload can be read row by row with openpyxl
+def is_streamable_workbook(file_path):
+    return load_workbook is not None and os.path.splitext(file_path)[1] in (".xlsx", ".xlsm")
+
+# Stream cleaned rows of one sheet of a downloaded upload
+def iter_upload_rows(file_path, sheet_name=None):
+    """CSV files and .xlsx/.xlsm workbooks are read row by row; other formats use the pandas reader."""
+    if os.path.splitext(file_path)[1] == ".csv":
+        yield from iter_csv_rows(file_path)
+    elif is_streamable_workbook(file_path):
+        yield from iter_xlsx_rows(file_path, sheet_name)
+    else:
+        df = pd.read_excel(file_path, sheet_name=sheet_name or 0)
+        yield from clean_nan_values(df.where(pd.notna(df), None).to_dict(orient="records"))
+
+# Find the sheets of a workbook whose header row looks like a server inventory
+def find_inventory_sheets(file_path):
+    """Returns the names of sheets with both a CPU and a RAM column, or [None] (the first
+    sheet) when there is no such sheet or the file is not a streamable workbook."""
+    if not is_streamable_workbook(file_path):
+        return [None]
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        inventory_sheets = []
+        for worksheet in workbook.worksheets:
+            header = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+            if {"CPU", "RAM"} <= {str(name) for name in header if name is not None}:
+                inventory_sheets.append(worksheet.title)
+        return inventory_sheets or [None]
+    finally:
+        workbook.close()
 
 # Extract CPU and RAM from requirements
 def extract_cpu_ram(requirements):
-    logger.info(f"Extracting CPU and RAM from requirements: {requirements}")
+    logger.info("Extracting CPU and RAM from requirements")
     filtered_requirements = []
     for req in requirements:
         try:
@@ -52,9 +184,9 @@ def extract_cpu_ram(requirements):
             ram_text = str(req.get('RAM', '')).strip()
 
             # Extract only numeric CPU value (e.g., "8" from "8 Cores @ 3.2GHz")
-            cpu_match = re.search(r'(\d+)\s*(?:Cores|vCPU|CPU|cpu)', cpu_text, re.IGNORECASE)
+            cpu_match = CPU_PATTERN.search(cpu_text)
             # Extract RAM value (e.g., "16" from "16GB")
-            ram_match = re.search(r'(\d+)', ram_text)
+            ram_match = RAM_PATTERN.search(ram_text)
 
             if cpu_match and ram_match:
                 filtered_requirements.append({
@@ -72,23 +204,500 @@ def extract_cpu_ram(requirements):
     logger.info(f"Filtered requirements: {filtered_requirements}")
     return filtered_requirements  # Returns a list of cleaned CPU and RAM values
 
+# Extract CPU and RAM over whole columns
+def extract_cpu_ram_columnar(requirements):
+    """Columnar equivalent of extract_cpu_ram for a DataFrame or a list of row dicts.
+
+    Both patterns run as vectorized string extraction over the CPU and RAM
+    columns, rejected rows are reported in one warning, and the result is in
+    the cost engine's requirement format. Rows are expected to share the same
+    columns, as they do when read from one sheet or CSV file.
+    """
+    df = requirements if isinstance(requirements, pd.DataFrame) else pd.DataFrame.from_records(list(requirements))
+    if df.empty:
+        return []
+
+    def column_text(name):
+        if name not in df:
+            return pd.Series("", index=df.index)
+        return df[name].astype(object).map(str)
+
+    def column_values(name, default):
+        if name not in df:
+            return [default] * len(df)
+        column = df[name].astype(object)
+        return column.where(column.notna(), None).tolist()
+
+    # Inventory columns repeat heavily, so each pattern runs once per distinct value
+    def column_extract(name, pattern):
+        codes, uniques = pd.factorize(column_text(name))
+        extracted = pd.Series(uniques, dtype=object).str.extract(pattern, expand=False).to_numpy(dtype=object)
+        return pd.Series(extracted[codes], index=df.index)
+
+    cpu = column_extract("CPU", CPU_PATTERN)
+    ram = column_extract("RAM", RAM_PATTERN)
+    valid = (cpu.notna() & ram.notna()).to_numpy()
+
+    rejected = (~valid).nonzero()[0]
+    if len(rejected):
+        logger.warning(f"Skipping {len(rejected)} entries with missing CPU/RAM at rows: {rejected[:20].tolist()}")
+
+    return [
+        {
+            'Server Name': server_name,
+            'IP Address': ip_address,
+            'Storage': storage,
+            'Database': database,
+            'CPU': int(cpu_value),
+            'RAM': int(ram_value)
+        }
+        for server_name, ip_address, storage, database, cpu_value, ram_value, is_valid in zip(
+            column_values('Server Name', 'Unknown'),
+            column_values('IP Address', 'Unknown'),
+            column_values('Storage', 'Unknown'),
+            column_values('Database', 'Unknown'),
+            cpu.tolist(),
+            ram.tolist(),
+            valid
+        )
+        if is_valid
+    ]
+
+# Extract CPU and RAM from streamed rows, one DataFrame chunk at a time
+def extract_cpu_ram_chunked(rows, chunk_size=EXTRACT_CHUNK_SIZE):
+    extracted = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            extracted.extend(extract_cpu_ram_columnar(chunk))
+            chunk = []
+    if chunk:
+        extracted.extend(extract_cpu_ram_columnar(chunk))
+    logger.info(f"Extracted {len(extracted)} requirements")
+    return extracted
+
+# Invoke CostCalculationLambda for one shard of requirements
+def invoke_cost_shard(requirements, client):
+    response = client.invoke(
+        FunctionName=CALCULATE_LAMBDA_NAME,
+        InvocationType="RequestResponse",
+        Payload=json.dumps({"requirements": requirements}, default=str)
+    )
+    response_payload = json.loads(response["Payload"].read())
+    processed_data = json.loads(response_payload.get("body", "[]"))
+    if response_payload.get("statusCode") != 200 or not isinstance(processed_data, list):
+        raise ValueError(f"Invalid response from {CALCULATE_LAMBDA_NAME}: {response_payload}")
+    return processed_data
+
+# Invoke a shard, retrying with exponential backoff
+def invoke_cost_shard_with_retry(shard_number, requirements, client):
+    for attempt in range(COST_SHARD_RETRIES + 1):
+        try:
+            return invoke_cost_shard(requirements, client)
+        except Exception as e:
+            if attempt == COST_SHARD_RETRIES:
+                raise
+            delay = 0.5 * (2 ** attempt)
+            logger.warning(f"Cost shard {shard_number} failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
+# Cost engine module, imported only when pricing in-process
+def load_cost_engine():
+    import CostCalculationLambda
+    return CostCalculationLambda
+
+# Price requirements across concurrent CostCalculationLambda invocations
+def invoke_cost_calculation(requirements, client=None, shard_size=None, max_concurrency=None):
+    """Splits requirements into shards, invokes them through a bounded thread pool and
+    merges the results back in input order. Any object with a Lambda-style invoke()
+    can be passed as client, e.g. an in-process stand-in for local runs. In the
+    in-process engine mode, and with no client given, the cost engine is called
+    directly with no payload serialization."""
+    started = time.perf_counter()
+    if COST_ENGINE_MODE == "inprocess" and client is None:
+        processed_data = load_cost_engine().estimate_costs(requirements)
+        logger.info(f"Cost calculation (inprocess) priced {len(requirements)} requirements in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return processed_data
+    client = client or lambda_client
+    shard_size = shard_size or COST_SHARD_SIZE
+    max_concurrency = max_concurrency or COST_MAX_CONCURRENCY
+    shards = [requirements[start:start + shard_size] for start in range(0, len(requirements), shard_size)]
+    if len(shards) <= 1 or max_concurrency <= 1:
+        results = [invoke_cost_shard_with_retry(number, shard, client) for number, shard in enumerate(shards)]
+    else:
+        logger.info(f"Invoking {len(shards)} cost shards with concurrency {max_concurrency}")
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(shards))) as executor:
+            results = list(executor.map(lambda numbered: invoke_cost_shard_with_retry(numbered[0], numbered[1], client), enumerate(shards)))
+    logger.info(f"Cost calculation (invoke) priced {len(requirements)} requirements in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return [row for rows in results for row in rows]
+
+# Parse and price one sheet of the downloaded upload
+def price_sheet(file_path, sheet_name):
+    requirements = extract_cpu_ram_chunked(iter_upload_rows(file_path, sheet_name))
+    logger.info(f"Sheet {sheet_name}: {len(requirements)} requirements")
+    return invoke_cost_calculation(requirements) if requirements else []
+
+# Add up the cost columns of a sheet's result rows
+def summarize_sheet(sheet_name, rows):
+    subtotal = {"Sheet": sheet_name, "Servers": len(rows)}
+    for column in COST_COLUMNS:
+        total = sum((Decimal(str(row.get(column) or "0").lstrip("$")) for row in rows), Decimal("0"))
+        subtotal[column] = f"${total:.2f}"
+    return subtotal
+
+# Parse and price every inventory sheet concurrently
+def process_inventory_sheets(file_path, sheet_names):
+    """Returns (combined rows tagged with their sheet, per-sheet subtotals plus a grand total).
+    Workers share the single downloaded copy of the workbook."""
+    with ThreadPoolExecutor(max_workers=min(SHEET_MAX_CONCURRENCY, len(sheet_names))) as executor:
+        results = list(executor.map(lambda sheet_name: price_sheet(file_path, sheet_name), sheet_names))
+    combined = [{"Sheet": sheet_name, **row} for sheet_name, rows in zip(sheet_names, results) for row in rows]
+    subtotals = [summarize_sheet(sheet_name, rows) for sheet_name, rows in zip(sheet_names, results)]
+    subtotals.append(summarize_sheet("All Sheets", combined))
+    return combined, subtotals
+
+# Hash a local file in chunks
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as local_file:
+        for chunk in iter(lambda: local_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Version of the prices the cost engine uses
+def get_pricing_version():
+    """The price catalog ETag when one is configured, otherwise PRICING_VERSION, otherwise the
+    UTC date, so results priced from the live Pricing API are reused for a day at most."""
+    if PRICE_CATALOG_BUCKET and PRICE_CATALOG_KEY:
+        return s3_client.head_object(Bucket=PRICE_CATALOG_BUCKET, Key=PRICE_CATALOG_KEY)["ETag"]
+    return os.environ.get("PRICING_VERSION") or f"live-{datetime.utcnow():%Y-%m-%d}"
+
+# Result cache backed by a local directory
+class LocalResultCache:
+    """Entries live in <directory>/<version>/<content hash>/; older versions are
+    dropped on every store and at most max_entries entries are kept."""
+
+    def __init__(self, directory, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def fetch_to_s3(self, version, content_hash, bucket, targets):
+        """Copies a fresh cached entry's files to S3; targets maps file names to keys.
+        Returns the names copied, or None on a miss (an entry always holds the result file)."""
+        entry = os.path.join(self.directory, version, content_hash)
+        if not os.path.exists(os.path.join(entry, "result")) or time.time() - os.path.getmtime(entry) >= self.ttl:
+            return None
+        copied = [name for name in targets if os.path.exists(os.path.join(entry, name))]
+        for name in copied:
+            content_type = OUTPUT_CONTENT_TYPES[OUTPUT_FORMAT] if name == "result" else "application/json"
+            s3_client.upload_file(os.path.join(entry, name), bucket, targets[name], ExtraArgs={"ContentType": content_type})
+        return copied
+
+    def store_from_s3(self, version, content_hash, bucket, targets):
+        entry = os.path.join(self.directory, version, content_hash)
+        os.makedirs(entry, exist_ok=True)
+        for name, key in targets.items():
+            s3_client.download_file(bucket, key, os.path.join(entry, name))
+        self.evict(version)
+
+    def evict(self, version):
+        for name in os.listdir(self.directory):
+            if name != version:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        version_dir = os.path.join(self.directory, version)
+        entries = sorted((os.path.join(version_dir, name) for name in os.listdir(version_dir)), key=os.path.getmtime)
+        for position, entry in enumerate(entries):
+            if position < len(entries) - self.max_entries or time.time() - os.path.getmtime(entry) >= self.ttl:
+                shutil.rmtree(entry, ignore_errors=True)
+
+# Result cache backed by an S3 prefix
+class S3ResultCache:
+    """Entries live under <prefix><version>/<content hash>/; older versions are deleted
+    on every store, and expired entries are ignored (an S3 lifecycle rule can purge them)."""
+
+    def __init__(self, bucket, prefix=RESULT_CACHE_PREFIX, ttl=RESULT_CACHE_TTL):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def fetch_to_s3(self, version, content_hash, bucket, targets):
+        entry = f"{self.prefix}{version}/{content_hash}/"
+        listing = s3_client.list_objects_v2(Bucket=self.bucket, Prefix=entry)
+        cached = {item["Key"][len(entry):]: item for item in listing.get("Contents", [])}
+        if "result" not in cached or time.time() - cached["result"]["LastModified"].timestamp() >= self.ttl:
+            return None
+        copied = [name for name in targets if name in cached]
+        for name in copied:
+            s3_client.copy_object(Bucket=bucket, Key=targets[name], CopySource={"Bucket": self.bucket, "Key": entry + name})
+        return copied
+
+    def store_from_s3(self, version, content_hash, bucket, targets):
+        entry = f"{self.prefix}{version}/{content_hash}/"
+        for name, key in targets.items():
+            s3_client.copy_object(Bucket=self.bucket, Key=entry + name, CopySource={"Bucket": bucket, "Key": key})
+        self.evict(version)
+
+    def evict(self, version):
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter="/"):
+            for common_prefix in page.get("CommonPrefixes", []):
+                if common_prefix["Prefix"] == f"{self.prefix}{version}/":
+                    continue
+                for objects in paginator.paginate(Bucket=self.bucket, Prefix=common_prefix["Prefix"]):
+                    stale = [{"Key": item["Key"]} for item in objects.get("Contents", [])]
+                    if stale:
+                        s3_client.delete_objects(Bucket=self.bucket, Delete={"Objects": stale})
+
+# Configured result cache, or None when caching is off
+def get_result_cache():
+    if RESULT_CACHE_DIR:
+        os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+        return LocalResultCache(RESULT_CACHE_DIR)
+    if RESULT_CACHE_BUCKET:
+        return S3ResultCache(RESULT_CACHE_BUCKET)
+    return None
+
+# Cache version: pricing version plus output schema and format, shortened to a path-safe token
+def get_result_cache_version():
+    return hashlib.sha256(f"{RESULT_CACHE_SCHEMA}:{OUTPUT_FORMAT}:{get_pricing_version()}".encode()).hexdigest()[:16]
+
+# Snapshot store backed by a local directory
+class LocalSnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self, lineage):
+        path = os.path.join(self.directory, f"{lineage}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+
+    def save(self, lineage, snapshot):
+        path = os.path.join(self.directory, f"{lineage}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(f"{path}.tmp", path)
+
+# Snapshot store backed by an S3 prefix
+class S3SnapshotStore:
+    def __init__(self, bucket, prefix=SNAPSHOT_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def load(self, lineage):
+        try:
+            response = s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{lineage}.json")
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read())
+
+    def save(self, lineage, snapshot):
+        s3_client.put_object(Bucket=self.bucket, Key=f"{self.prefix}{lineage}.json", Body=json.dumps(snapshot), ContentType="application/json")
+
+# Configured snapshot store, or None when incremental re-pricing is off
+def get_snapshot_store():
+    if SNAPSHOT_DIR:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        return LocalSnapshotStore(SNAPSHOT_DIR)
+    if SNAPSHOT_BUCKET:
+        return S3SnapshotStore(SNAPSHOT_BUCKET)
+    return None
+
+# Lineage shared by successive uploads of the same inventory to the same S3 directory
+def file_lineage(file_key):
+    """Keeps the key's directories so custA/inventory.xlsx and custB/inventory.xlsx
+    do not share a snapshot; uploads at the bucket root keep their bare name."""
+    directory, filename = os.path.split(os.path.splitext(file_key)[0])
+    name = re.sub(r'[^a-z0-9._-]+', "-", LINEAGE_SUFFIX_PATTERN.sub("", filename).strip().lower()) or "inventory"
+    folders = [re.sub(r'[^a-z0-9._-]+', "-", folder.strip().lower()) for folder in directory.split("/")]
+    return "/".join([folder for folder in folders if folder.strip(".")] + [name])
+
+# Hash of the requirement fields that determine a row's cost
+def requirement_cost_key(req):
+    return hashlib.sha1(json.dumps([str(req.get(field, "")) for field in COST_KEY_FIELDS]).encode()).hexdigest()
+
+# Identity of each requirement row: server name and IP, numbered when repeated
+def requirement_identities(requirements):
+    seen = {}
+    identities = []
+    for req in requirements:
+        identity = f"{req.get('Server Name', 'Unknown')}|{req.get('IP Address', 'Unknown')}"
+        seen[identity] = seen.get(identity, 0) + 1
+        identities.append(identity if seen[identity] == 1 else f"{identity}#{seen[identity]}")
+    return identities
+
+# Re-price only requirements whose cost inputs were not priced in the previous run
+def price_incrementally(requirements, snapshot, pricing_version):
+    """Returns (priced rows, delta report, new snapshot).
+
+    A snapshot maps each row identity to its cost key and each cost key to its
+    priced row, so only cost keys missing from the previous run are sent to the
+    cost engine; the rest are copied. A snapshot from another pricing version
+    keeps its identities for the delta report but none of its prices.
+    """
+    snapshot = snapshot or {"rows": {}, "costs": {}}
+    reusable_costs = snapshot["costs"] if snapshot.get("version") == pricing_version else {}
+    cost_keys = [requirement_cost_key(req) for req in requirements]
+
+    # Price each missing cost key once, tagged so results map back even when rows are dropped
+    to_price = {}
+    for cost_key, req in zip(cost_keys, requirements):
+        if cost_key not in reusable_costs and cost_key not in to_price:
+            to_price[cost_key] = {**req, "Server Name": cost_key}
+    priced_costs = {}
+    if to_price:
+        for row in invoke_cost_calculation(list(to_price.values())):
+            priced_costs[row["Server Name"]] = row
+    costs = {**reusable_costs, **priced_costs}
+
+    processed_data = []
+    for cost_key, req in zip(cost_keys, requirements):
+        if cost_key in costs:
+            processed_data.append({**costs[cost_key], "Server Name": req.get("Server Name", "Unknown")})
+        else:
+            logger.warning(f"No cost calculated for: {req.get('Server Name', 'Unknown')}")
+
+    rows = dict(zip(requirement_identities(requirements), cost_keys))
+    previous_rows = snapshot["rows"]
+    changed = [identity for identity, cost_key in rows.items() if identity in previous_rows and previous_rows[identity] != cost_key]
+    delta = {
+        "Added": [identity for identity in rows if identity not in previous_rows],
+        "Changed": [
+            {
+                "Row": identity,
+                "Previous Total": snapshot["costs"].get(previous_rows[identity], {}).get("Total Pricing"),
+                "Total": costs.get(rows[identity], {}).get("Total Pricing")
+            }
+            for identity in changed
+        ],
+        "Removed": [identity for identity in previous_rows if identity not in rows],
+        "Unchanged": sum(1 for identity, cost_key in rows.items() if previous_rows.get(identity) == cost_key),
+        "Repriced Requirements": len(to_price),
+        "Reused Rows": sum(1 for cost_key in cost_keys if cost_key in reusable_costs),
+        "Prices Refreshed": bool(previous_rows) and snapshot.get("version") != pricing_version
+    }
+    used_keys = set(cost_keys)
+    new_snapshot = {
+        "version": pricing_version,
+        "rows": rows,
+        "costs": {cost_key: row for cost_key, row in costs.items() if cost_key in used_keys}
+    }
+    return processed_data, delta, new_snapshot
+
+# Column names of result rows, in order of first appearance
+def result_fieldnames(data):
+    return list(dict.fromkeys(name for row in data for name in row))
+
 # Store results in S3 as CSV
 def store_results_in_s3_csv(data, bucket, key):
+    """Encodes rows OUTPUT_CHUNK_ROWS at a time and uploads the text in multipart parts,
+    so the whole CSV is never held in memory; small outputs use a single put_object."""
+    upload_id = None
     try:
         # Ensure data is a list of dictionaries
         if not isinstance(data, list) or not all(isinstance(i, dict) for i in data):
             logger.error(f"Invalid processed data format: {data}")
             return False
 
-        df = pd.DataFrame(data)
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False)
-        s3_client.put_object(Bucket=bucket, Key=key, Body=csv_buffer.getvalue(), ContentType="text/csv")
+        fieldnames = result_fieldnames(data)
+        buffer = io.BytesIO()
+        text = io.TextIOWrapper(buffer, encoding="utf-8", newline="", write_through=True)
+        writer = csv.DictWriter(text, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        parts = []
+        for start in range(0, len(data), OUTPUT_CHUNK_ROWS):
+            writer.writerows(data[start:start + OUTPUT_CHUNK_ROWS])
+            if buffer.tell() >= MULTIPART_PART_SIZE:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, ContentType="text/csv")["UploadId"]
+                part = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=buffer.getvalue())
+                parts.append({"PartNumber": len(parts) + 1, "ETag": part["ETag"]})
+                buffer.seek(0)
+                buffer.truncate()
+
+        if upload_id is None:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), ContentType="text/csv")
+        else:
+            if buffer.tell():
+                part = s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=buffer.getvalue())
+                parts.append({"PartNumber": len(parts) + 1, "ETag": part["ETag"]})
+            s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
         logger.info(f"Results uploaded to S3: s3://{bucket}/{key}")
         return True
     except Exception as e:
         logger.error(f"Error uploading CSV to S3: {e}")
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        return False
+
+# Numeric value of a cost cell such as "$1234.56" or "-$3.00"
+def to_number(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace("$", "").replace(",", ""))
+    except ValueError:
+        return None
+
+# Arrow array for one column of a chunk of result rows
+def result_column(name, values):
+    column_type = RESULT_COLUMN_TYPES.get(name)
+    if column_type == "float64":
+        return pa.array([to_number(value) for value in values], type=pa.float64())
+    if column_type == "int64":
+        return pa.array([None if value is None else int(to_number(value)) for value in values], type=pa.int64())
+    return pa.array(
+        [value if value is None or isinstance(value, str) else json.dumps(value, default=str) for value in values],
+        type=pa.string()
+    )
+
+# Store results in S3 as Parquet or Arrow IPC with typed numeric columns
+def store_results_in_s3_columnar(data, bucket, key, output_format):
+    """Writes record batches of OUTPUT_CHUNK_ROWS rows to a local file, then uploads it."""
+    if pa is None:
+        logger.error(f"pyarrow is not available; cannot write {output_format} output")
+        return False
+    if not isinstance(data, list) or not all(isinstance(i, dict) for i in data):
+        logger.error(f"Invalid processed data format: {data}")
+        return False
+    fd, local_path = tempfile.mkstemp(suffix=f".{output_format}")
+    os.close(fd)
+    try:
+        fieldnames = result_fieldnames(data)
+        schema = pa.schema([(name, pa.type_for_alias(RESULT_COLUMN_TYPES.get(name, "string"))) for name in fieldnames])
+        sink = None
+        if output_format == "parquet":
+            writer = pq.ParquetWriter(local_path, schema)
+        else:
+            sink = pa.OSFile(local_path, "wb")
+            writer = pa.ipc.new_file(sink, schema)
+        try:
+            for start in range(0, len(data), OUTPUT_CHUNK_ROWS):
+                chunk = data[start:start + OUTPUT_CHUNK_ROWS]
+                writer.write_batch(pa.record_batch([result_column(name, [row.get(name) for row in chunk]) for name in fieldnames], schema=schema))
+        finally:
+            writer.close()
+            if sink is not None:
+                sink.close()
+        s3_client.upload_file(local_path, bucket, key, ExtraArgs={"ContentType": OUTPUT_CONTENT_TYPES[output_format]})
+        logger.info(f"Results uploaded to S3: s3://{bucket}/{key}")
+        return True
+    except Exception as e:
+        logger.error(f"Error uploading {output_format} results to S3: {e}")
         return False
+    finally:
+        os.remove(local_path)
+
+# Store results in S3 in the configured output format
+def store_results_in_s3(data, bucket, key, output_format=None):
+    output_format = output_format or OUTPUT_FORMAT
+    if output_format == "csv":
+        return store_results_in_s3_csv(data, bucket, key)
+    return store_results_in_s3_columnar(data, bucket, key, output_format)
 
 # Function to remove NaN values
 def clean_nan_values(obj):
@@ -125,18 +734,86 @@ def lambda_handler(event, context):
         logger.info(f"Error File Key: {ERROR_FILE_KEY}")
 
         # Create a filename with IST timestamp
-        CSV_FILE_KEY = f"Price_{original_filename}_{timestamp_str}.csv"
-        logger.info(f"CSV File Key: {CSV_FILE_KEY}")
+        RESULT_FILE_KEY = f"Price_{original_filename}_{timestamp_str}.{OUTPUT_FORMAT}"
+        logger.info(f"Result File Key: {RESULT_FILE_KEY}")
+
+        # Per-sheet subtotals of multi-sheet workbooks
+        SUMMARY_FILE_KEY = f"Summary_{original_filename}_{timestamp_str}.json"
+
+        # Rows added, changed and removed since the previous upload of the same inventory
+        DELTA_FILE_KEY = f"Delta_{original_filename}_{timestamp_str}.json"
         
-        requirements = fetch_requirements_from_s3(bucket, file_key)
-        logger.info(f"Requirements fetched from S3: {requirements}")
-        if not requirements:
+        # Download the upload once; every sheet reader shares the local copy
+        try:
+            upload_path = download_upload(bucket, file_key)
+        except Exception as e:
+            logger.error(f"Error fetching file from S3: {e}")
             error_response = {"statusCode": 500, "body": "Failed to fetch server requirements from uploaded file."}
             return error_response
 
-        # Clean NaN values
-        cleaned_requirements = clean_nan_values(requirements)
-        extracted_requirements = extract_cpu_ram(cleaned_requirements)
+        # Serve a previous result for the same file bytes and pricing version; incremental runs
+        # always parse the upload so every upload gets its delta and advances the lineage snapshot
+        snapshot_store = get_snapshot_store()
+        result_cache = None
+        try:
+            result_cache = get_result_cache() if not snapshot_store else None
+            if result_cache:
+                cache_version, content_hash = get_result_cache_version(), hash_file(upload_path)
+                cached_targets = {"result": RESULT_FILE_KEY, "summary.json": SUMMARY_FILE_KEY}
+                copied = result_cache.fetch_to_s3(cache_version, content_hash, BUCKET_NAME, cached_targets)
+                if copied is not None:
+                    logger.info(f"Result cache hit for {file_key} ({content_hash})")
+                    if "summary.json" in copied:
+                        subtotals = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=SUMMARY_FILE_KEY)["Body"].read())
+                        response = {
+                            "statusCode": 200,
+                            "body": json.dumps({"csv": f"s3://{BUCKET_NAME}/{RESULT_FILE_KEY}", "summary": f"s3://{BUCKET_NAME}/{SUMMARY_FILE_KEY}", "subtotals": subtotals})
+                        }
+                    else:
+                        response = {"statusCode": 200, "body": json.dumps(f"{OUTPUT_FORMAT.upper()} stored at s3://{BUCKET_NAME}/{RESULT_FILE_KEY}")}
+                    # Only now is the upload no longer needed for a fresh run
+                    os.remove(upload_path)
+                    return response
+        except Exception as e:
+            logger.error(f"Result cache lookup failed: {e}")
+            result_cache = None
+
+        # Record a stored result in the cache; failures only cost a future cache miss
+        def remember_result(targets):
+            if not result_cache:
+                return
+            try:
+                result_cache.store_from_s3(cache_version, content_hash, BUCKET_NAME, targets)
+            except Exception as e:
+                logger.error(f"Result cache store failed: {e}")
+
+        try:
+            sheet_names = find_inventory_sheets(upload_path)
+            if len(sheet_names) > 1:
+                logger.info(f"Processing inventory sheets: {sheet_names}")
+                processed_data, subtotals = process_inventory_sheets(upload_path, sheet_names)
+                if not processed_data:
+                    error_response = {"statusCode": 500, "body": "No valid CPU/RAM data found."}
+                    s3_client.put_object(Bucket=bucket, Key=ERROR_FILE_KEY, Body=json.dumps(error_response), ContentType="application/json")
+                    return error_response
+                if not store_results_in_s3(processed_data, bucket=BUCKET_NAME, key=RESULT_FILE_KEY):
+                    return {"statusCode": 500, "body": json.dumps("Failed to store results in S3.")}
+                s3_client.put_object(Bucket=BUCKET_NAME, Key=SUMMARY_FILE_KEY, Body=json.dumps(subtotals), ContentType="application/json")
+                remember_result({"result": RESULT_FILE_KEY, "summary.json": SUMMARY_FILE_KEY})
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps({"csv": f"s3://{BUCKET_NAME}/{RESULT_FILE_KEY}", "summary": f"s3://{BUCKET_NAME}/{SUMMARY_FILE_KEY}", "subtotals": subtotals})
+                }
+
+            # Stream cleaned rows from the upload straight into CPU/RAM extraction
+            extracted_requirements = extract_cpu_ram_chunked(iter_upload_rows(upload_path, sheet_names[0]))
+        except Exception as e:
+            logger.error(f"Error processing uploaded file: {e}")
+            error_response = {"statusCode": 500, "body": "Failed to fetch server requirements from uploaded file."}
+            return error_response
+        finally:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
 
         if not extracted_requirements:
             error_response = {"statusCode": 500, "body": "No valid CPU/RAM data found."}
@@ -149,23 +826,68 @@ def lambda_handler(event, context):
             logger.info(f"Error response uploaded to S3: s3://{bucket}/{ERROR_FILE_KEY}")
             return error_response
 
+        # Reprice only what changed since the last upload of this inventory
+        if snapshot_store:
+            lineage = file_lineage(file_key)
+            try:
+                previous_snapshot = snapshot_store.load(lineage)
+            except Exception as e:
+                # An unreadable snapshot only costs a full re-price
+                logger.error(f"Error loading snapshot for {lineage}: {e}")
+                previous_snapshot = None
+            try:
+                pricing_version = get_result_cache_version()
+                processed_data, delta, snapshot = price_incrementally(extracted_requirements, previous_snapshot, pricing_version)
+            except Exception as e:
+                logger.error(f"Error invoking {CALCULATE_LAMBDA_NAME}: {e}")
+                return {"statusCode": 500, "body": json.dumps("Failed to calculate costs.")}
+            logger.info(f"Incremental pricing for {lineage}: repriced {delta['Repriced Requirements']} requirements, reused {delta['Reused Rows']} rows")
+            if not store_results_in_s3(processed_data, bucket=BUCKET_NAME, key=RESULT_FILE_KEY):
+                return {"statusCode": 500, "body": json.dumps("Failed to store results in S3.")}
+            s3_client.put_object(Bucket=BUCKET_NAME, Key=DELTA_FILE_KEY, Body=json.dumps(delta), ContentType="application/json")
+            try:
+                snapshot_store.save(lineage, snapshot)
+            except Exception as e:
+                logger.error(f"Failed to save snapshot for {lineage}: {e}")
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"csv": f"s3://{BUCKET_NAME}/{RESULT_FILE_KEY}", "delta": f"s3://{BUCKET_NAME}/{DELTA_FILE_KEY}"})
+            }
+
         # Invoke CostCalculationLambda
-        response = lambda_client.invoke(
-            FunctionName=CALCULATE_LAMBDA_NAME,
-            InvocationType="RequestResponse",
-            Payload=json.dumps({"requirements": extracted_requirements}, default=str)
-        )
+        if STREAM_RESULTS and OUTPUT_FORMAT == "csv":
+            stream_event = {"requirements": extracted_requirements, "output": {"bucket": BUCKET_NAME, "key": RESULT_FILE_KEY}}
+            if COST_ENGINE_MODE == "inprocess":
+                response_payload = load_cost_engine().lambda_handler(stream_event, context)
+            else:
+                response = lambda_client.invoke(
+                    FunctionName=CALCULATE_LAMBDA_NAME,
+                    InvocationType="RequestResponse",
+                    Payload=json.dumps(stream_event, default=str)
+                )
+                response_payload = json.loads(response["Payload"].read())
+            summary = json.loads(response_payload.get("body", "{}"))
+            if response_payload.get("statusCode") != 200 or not isinstance(summary, dict) or "key" not in summary:
+                logger.error(f"Streaming cost calculation failed: {response_payload}")
+                return {"statusCode": 500, "body": json.dumps("Failed to store results in S3.")}
+            logger.info(f"Cost calculation streamed {summary['rows']} rows to s3://{summary['bucket']}/{summary['key']}")
+            remember_result({"result": RESULT_FILE_KEY})
+            return {"statusCode": 200, "body": json.dumps(f"{OUTPUT_FORMAT.upper()} stored at s3://{summary['bucket']}/{summary['key']}")}
 
-        response_payload = json.loads(response["Payload"].read())
-        processed_data = json.loads(response_payload.get("body", "[]"))
+        try:
+            processed_data = invoke_cost_calculation(extracted_requirements)
+        except Exception as e:
+            logger.error(f"Error invoking {CALCULATE_LAMBDA_NAME}: {e}")
+            return {"statusCode": 500, "body": json.dumps("Failed to calculate costs.")}
 
         # Log and Validate processed data
         if not isinstance(processed_data, list) or not all(isinstance(i, dict) for i in processed_data):
             logger.error(f"Invalid processed data format received: {processed_data}")
             return {"statusCode": 500, "body": json.dumps("Invalid processed data format.")}
 
-        if store_results_in_s3_csv(processed_data, bucket=BUCKET_NAME, key=CSV_FILE_KEY):
-            return {"statusCode": 200, "body": json.dumps(f"CSV stored at s3://{BUCKET_NAME}/{CSV_FILE_KEY}")}
+        if store_results_in_s3(processed_data, bucket=BUCKET_NAME, key=RESULT_FILE_KEY):
+            remember_result({"result": RESULT_FILE_KEY})
+            return {"statusCode": 200, "body": json.dumps(f"{OUTPUT_FORMAT.upper()} stored at s3://{BUCKET_NAME}/{RESULT_FILE_KEY}")}
 
         return {"statusCode": 500, "body": json.dumps("Failed to store results in S3.")}
 
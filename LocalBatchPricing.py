@@ -0,0 +1,184 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# The Lambda modules create boto3 clients at import time; give them a region when run locally
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Upload types ExtractLambda can read
+INVENTORY_PATTERNS = ("*.xlsx", "*.xlsm", "*.xls", "*.csv")
+
+# Per-worker Lambda modules, imported by init_worker
+extract_module = None
+cost_module = None
+
+# Load the Lambda modules and the read-only catalogues once per worker process
+def init_worker(instance_catalog_path, price_catalog_path):
+    """Catalogue paths are exported before import because both modules read their
+    configuration from the environment when they are loaded. A given instance
+    catalogue file is used as-is, however old it is."""
+    global extract_module, cost_module
+    if instance_catalog_path:
+        os.environ["INSTANCE_CATALOG_CACHE_PATH"] = instance_catalog_path
+        os.environ["INSTANCE_CATALOG_TTL"] = str(10 ** 12)
+    if price_catalog_path:
+        os.environ["PRICE_CATALOG_PATH"] = price_catalog_path
+    os.environ["COST_ENGINE_MODE"] = "inprocess"
+
+    import ExtractLambda
+    import CostCalculationLambda
+    extract_module, cost_module = ExtractLambda, CostCalculationLambda
+    # The Lambda modules log every row at INFO on the root logger
+    logging.getLogger().setLevel(logging.WARNING)
+    instances, _ = cost_module.get_ec2_instance_types()
+    cost_module.load_price_catalog()
+    logger.info(f"Worker {os.getpid()} loaded {len(instances)} instance types")
+
+# Parse and price one workbook with the same readers as ExtractLambda
+def price_workbook(file_path):
+    """Returns (priced rows, requirement count, seconds taken); rows of
+    multi-sheet workbooks are tagged with their sheet like ExtractLambda does."""
+    started = time.perf_counter()
+    sheet_names = extract_module.find_inventory_sheets(file_path)
+    rows = []
+    requirement_count = 0
+    for sheet_name in sheet_names:
+        requirements = extract_module.extract_cpu_ram_chunked(extract_module.iter_upload_rows(file_path, sheet_name))
+        requirement_count += len(requirements)
+        priced = cost_module.estimate_costs(requirements)
+        if len(sheet_names) > 1:
+            priced = [{"Sheet": sheet_name, **row} for row in priced]
+        rows.extend(priced)
+    return rows, requirement_count, time.perf_counter() - started
+
+# Write priced rows next to the other results
+def write_result_csv(rows, output_path):
+    fieldnames = list(dict.fromkeys(name for row in rows for name in row))
+    with open(output_path, "w", newline="", encoding="utf-8") as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+
+# Result file name derived from the input's path under the input directory
+def result_file_name(file_path, input_dir):
+    """Keeps subdirectories and the extension so sub/inv.xlsx, inv.xlsx and inv.csv
+    get distinct results: Price_sub__inv.xlsx.csv, Price_inv.xlsx.csv, Price_inv.csv.csv."""
+    relative_path = os.path.relpath(file_path, input_dir)
+    return "Price_" + relative_path.replace(os.sep, "__") + ".csv"
+
+# Price one file and write its result; errors are reported, not raised
+def process_file(file_path, input_dir, output_dir):
+    try:
+        rows, requirement_count, seconds = price_workbook(file_path)
+        output_path = os.path.join(output_dir, result_file_name(file_path, input_dir))
+        if rows:
+            write_result_csv(rows, output_path)
+        return {
+            "File": file_path, "Output": output_path if rows else None,
+            "Requirements": requirement_count, "Rows": len(rows), "Seconds": round(seconds, 3)
+        }
+    except Exception as e:
+        return {"File": file_path, "Error": str(e)}
+
+# Inventory files under the input directory
+def find_inventory_files(input_dir, recursive=False):
+    files = []
+    for pattern in INVENTORY_PATTERNS:
+        files.extend(glob.glob(os.path.join(input_dir, "**" if recursive else "", pattern), recursive=recursive))
+    return sorted(path for path in set(files) if not os.path.basename(path).startswith(("Price_", "~$")))
+
+# Fetch the instance catalogue into a file; runs in a child so this process never imports the Lambda modules
+def fetch_instance_catalog(instance_catalog_path):
+    os.environ["INSTANCE_CATALOG_CACHE_PATH"] = instance_catalog_path
+    import CostCalculationLambda
+    instances, _ = CostCalculationLambda.get_ec2_instance_types()
+    return len(instances)
+
+# Instance catalogue shared by every worker, fetched from EC2 once per batch (or reused if fetched today)
+def prepare_instance_catalog(output_dir):
+    instance_catalog_path = os.path.abspath(os.path.join(output_dir, "ec2_instance_types.json"))
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        instance_count = executor.submit(fetch_instance_catalog, instance_catalog_path).result()
+    if not instance_count or not os.path.exists(instance_catalog_path):
+        logger.error("Could not fetch the EC2 instance catalogue; workers will fetch it themselves")
+        return None
+    logger.info(f"Workers share {instance_count} instance types from {instance_catalog_path}")
+    return instance_catalog_path
+
+# Price every file across a process pool and summarize throughput
+def run_batch(files, input_dir, output_dir, workers, instance_catalog_path=None, price_catalog_path=None):
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    if not instance_catalog_path:
+        instance_catalog_path = prepare_instance_catalog(output_dir)
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(instance_catalog_path, price_catalog_path)
+    ) as executor:
+        futures = {executor.submit(process_file, file_path, input_dir, output_dir): file_path for file_path in files}
+        for future in as_completed(futures):
+            result = future.result()
+            if "Error" in result:
+                logger.error(f"Failed to price {result['File']}: {result['Error']}")
+            else:
+                logger.info(f"Priced {result['File']}: {result['Rows']} rows in {result['Seconds']}s")
+            results.append(result)
+    elapsed = time.perf_counter() - started
+    priced = [result for result in results if "Error" not in result]
+    rows = sum(result["Rows"] for result in priced)
+    return {
+        "Files": len(files),
+        "Succeeded": len(priced),
+        "Failed": len(results) - len(priced),
+        "Requirements": sum(result["Requirements"] for result in priced),
+        "Rows": rows,
+        "Workers": workers,
+        "Elapsed Seconds": round(elapsed, 3),
+        "Files Per Second": round(len(files) / elapsed, 3) if elapsed else None,
+        "Rows Per Second": round(rows / elapsed, 1) if elapsed else None,
+        "Results": sorted(results, key=lambda result: result["File"])
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Price a directory of inventory workbooks locally.")
+    parser.add_argument("input_dir", help="Directory of .xlsx/.xls/.csv inventories")
+    parser.add_argument("-o", "--output-dir", default="priced", help="Where Price_*.csv files and the summary are written")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include subdirectories")
+    parser.add_argument("--instance-catalog", help="Instance catalogue JSON as cached by CostCalculationLambda (fetched once into the output directory by default)")
+    parser.add_argument("--price-catalog", help="EC2 bulk offer file (JSON) to price from instead of the Pricing API")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = find_inventory_files(args.input_dir, args.recursive)
+    if not files:
+        logger.error(f"No inventory files found in {args.input_dir}")
+        return 1
+    summary = run_batch(
+        files, args.input_dir, args.output_dir, max(1, min(args.workers, len(files))),
+        instance_catalog_path=os.path.abspath(args.instance_catalog) if args.instance_catalog else None,
+        price_catalog_path=os.path.abspath(args.price_catalog) if args.price_catalog else None
+    )
+    summary_path = os.path.join(args.output_dir, "batch_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    logger.info(
+        f"Priced {summary['Succeeded']}/{summary['Files']} files ({summary['Rows']} rows) in "
+        f"{summary['Elapsed Seconds']}s: {summary['Files Per Second']} files/s, {summary['Rows Per Second']} rows/s"
+    )
+    logger.info(f"Summary written to {summary_path}")
+    return 0 if not summary["Failed"] else 2
+
+if __name__ == "__main__":
+    raise SystemExit(main())